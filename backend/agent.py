@@ -1,49 +1,360 @@
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
 import os
-from rag_indexer import get_index
+import re
+import threading
+from llama_index.core import Settings
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores import MetadataFilter, MetadataFilters, FilterOperator, FilterCondition
+from llama_index.core.query_engine import RetrieverQueryEngine
+from rag_indexer import get_summary_collection, embed_model_id
+from index_registry import get_shared_index
+from measure_store import get_measure_store
+from embedding_cache import get_query_embedding_cache
+from answer_cache import get_answer_cache
+from melody_index import search_melody, parse_fragment, find_melody_fragment, NGRAM
+from melodic_similarity import similar_scores
+from lyrics_index import search_lyrics
+from retrievers import HybridRetriever, HierarchicalRetriever, SIMILARITY_TOP_K
+from rerank import BudgetedRerank, warm_cross_encoder, RERANK_ENABLED, RERANK_CANDIDATES
 
-# Initialize LlamaIndex (Lazy load to avoid overhead on import if possible, but for now global)
-_index = None
+# "hierarchical" narrows to the best-matching scores first; "hybrid" searches all measures
+RETRIEVAL_MODE = os.environ.get("CLEF_RETRIEVAL", "hierarchical")
 
-def get_rag_engine():
-    global _index
-    if _index is None:
-        # Load from persistence
-        _index = get_index(data_dir="../MusicXML_test", persist_dir="data/chromadb")
-    return _index.as_query_engine() if _index else None
+# Long-lived query engines, one per index and filter combination
+MAX_ENGINES = 32
+_engines: "OrderedDict[tuple, RetrieverQueryEngine]" = OrderedDict()
+_engines_lock = threading.Lock()
 
-def music_retrieval(query: str, instrument: Optional[str] = None, measure_number: Optional[int] = None):
+def get_rag_engine(filters: Optional[MetadataFilters] = None, streaming: bool = False):
+    # Same index handle as the API's, published once the corpora are synced
+    index = get_shared_index()
+    with _engines_lock:
+        key = (id(index), repr(filters) if filters else None, streaming)
+        engine = _engines.get(key)
+        if engine is None:
+            # With reranking, over-fetch candidates and let the cross-encoder keep the best
+            top_k = max(RERANK_CANDIDATES, SIMILARITY_TOP_K) if RERANK_ENABLED else SIMILARITY_TOP_K
+            if RETRIEVAL_MODE == "hierarchical":
+                retriever = HierarchicalRetriever(index, get_summary_collection(), filters=filters, top_k=top_k)
+            else:
+                # Vector and BM25 search merged by rank fusion
+                retriever = HybridRetriever(index, filters=filters, top_k=top_k)
+            postprocessors = []
+            if RERANK_ENABLED:
+                warm_cross_encoder()
+                postprocessors.append(BudgetedRerank(top_n=SIMILARITY_TOP_K))
+            engine = RetrieverQueryEngine.from_args(retriever, node_postprocessors=postprocessors, streaming=streaming)
+            _engines[key] = engine
+            while len(_engines) > MAX_ENGINES:
+                _engines.popitem(last=False)
+        _engines.move_to_end(key)
+        return engine
+
+def _query_embedding(query: str) -> List[float]:
+    """Embedding of a question, reusing cached embeddings of repeated questions."""
+    return get_query_embedding_cache().get_or_compute(
+        query, Settings.embed_model.get_query_embedding, embed_model_id()
+    )
+
+def _query_bundle(query: str) -> QueryBundle:
+    """Query with its embedding attached."""
+    return QueryBundle(query_str=query, embedding=_query_embedding(query))
+
+def build_metadata_filters(instrument: Optional[str] = None, measure_number: Optional[int] = None,
+                           title: Optional[str] = None, file_name: Optional[str] = None) -> Optional[MetadataFilters]:
+    """Translate retrieval arguments into Chroma metadata filters.
+
+    Filters run inside the vector store before similarity ranking, so only
+    matching chunks are scored.
     """
-    Retrieves musical information from the sheet music database.
+    filters = []
+    if instrument:
+        # Part names are stored as written in the score ("Bass"); vertical
+        # chunks cover every part and are stored as "All Parts"
+        variants = list(dict.fromkeys([instrument, instrument.title(), instrument.lower(), instrument.upper(), "All Parts"]))
+        filters.append(MetadataFilter(key="instrument", value=variants, operator=FilterOperator.IN))
+    if measure_number is not None:
+        # Matches single-measure chunks and windows that contain the measure
+        filters.append(MetadataFilter(key="measure_start", value=measure_number, operator=FilterOperator.LTE))
+        filters.append(MetadataFilter(key="measure_end", value=measure_number, operator=FilterOperator.GTE))
+    if title:
+        filters.append(MetadataFilter(key="title", value=title, operator=FilterOperator.EQ))
+    if file_name:
+        filters.append(MetadataFilter(key="file_name", value=file_name, operator=FilterOperator.EQ))
+    if not filters:
+        return None
+    return MetadataFilters(filters=filters, condition=FilterCondition.AND)
+
+def exact_measure_lookup(score: str, instrument: Optional[str] = None,
+                         measure_number: Optional[int] = None) -> Optional[Tuple[str, List[str]]]:
+    """Answer a (score, part, measure) question straight from the measure store.
+
+    Returns (answer, chunk ids), or None when nothing matches so callers can
+    fall back to vector search.
     """
-    engine = get_rag_engine()
+    rows = get_measure_store().lookup(score, instrument, measure_number)
+    if not rows:
+        return None
+    answer = "\n".join(f"[{row['metadata'].get('title', score)}] {row['text'].strip()}" for row in rows)
+    return answer, [row["id"] for row in rows]
+
+# "measure 5", "bar 12", "m. 3", "5마디", "5번째 마디", "마디 5"
+_MEASURE_RE = re.compile(r"\b(?:measures?|bars?|m\.)\s*(\d+)|(\d+)\s*(?:번째\s*)?마디|마디\s*(\d+)", re.IGNORECASE)
+
+def _mentions(folded: str, name: str) -> bool:
+    # Korean particles attach to the name ("믿나이다의", "알토는"), so a run of Hangul may follow it
+    return re.search(rf"(?<!\w){re.escape(name.casefold())}(?=[가-힣]*(?!\w))", folded) is not None
+
+def extract_query_keys(message: str) -> Dict[str, Any]:
+    """The score, part and measure number a question names, as music_retrieval arguments.
+
+    Scores and parts are only recognised by the names the measure store
+    knows, longest first, so ordinary words never turn into filters.
+    """
+    keys: Dict[str, Any] = {}
+    measure = _MEASURE_RE.search(message)
+    if measure:
+        keys["measure_number"] = int(next(group for group in measure.groups() if group))
+    folded = message.casefold()
+    scores, parts = get_measure_store().names()
+    candidates = []
+    for file_name, file_stem, title in scores:
+        if file_name:
+            candidates += [(file_name, "file_name", file_name), (file_stem, "file_name", file_name)]
+        if title:
+            candidates.append((title, "title", title))
+    for name, key, value in sorted(candidates, key=lambda item: len(item[0] or ""), reverse=True):
+        # Bare numbers ("001") would match measure numbers
+        if name and len(name) > 2 and not name.isdigit() and _mentions(folded, name):
+            keys[key] = value
+            break
+    for part in sorted(parts, key=len, reverse=True):
+        if len(part) > 1 and _mentions(folded, part):
+            keys["instrument"] = part
+            break
+    return keys
+
+def _exact_lookup(instrument: Optional[str], measure_number: Optional[int], title: Optional[str],
+                  file_name: Optional[str]) -> Optional[Tuple[str, List[str]]]:
+    score = file_name or title
+    if score and measure_number is not None:
+        return exact_measure_lookup(score, instrument, measure_number)
+    return None
+
+def _vector_retrieval(query_bundle: QueryBundle, filters: Optional[MetadataFilters]) -> Tuple[str, List[str]]:
+    engine = get_rag_engine(filters)
     if not engine:
+        return "RAG engine not initialized.", []
+    response = engine.query(query_bundle)
+    return str(response), [node.node.node_id for node in response.source_nodes]
+
+def _music_retrieval(query: str, instrument: Optional[str] = None, measure_number: Optional[int] = None,
+                     title: Optional[str] = None, file_name: Optional[str] = None) -> Tuple[str, List[str]]:
+    """music_retrieval returning (answer, ids of the chunks it was built from)."""
+    exact = _exact_lookup(instrument, measure_number, title, file_name)
+    if exact:
+        return exact
+    return _vector_retrieval(_query_bundle(query), build_metadata_filters(instrument, measure_number, title, file_name))
+
+def music_retrieval(query: str, instrument: Optional[str] = None, measure_number: Optional[int] = None,
+                    title: Optional[str] = None, file_name: Optional[str] = None):
+    """
+    Retrieves musical information from the sheet music database.
+
+    instrument, measure_number, title and file_name restrict the search to
+    matching chunks via metadata filters. When a score (title or file name)
+    and a measure number are both given, the measure store answers exactly
+    without any embedding or vector search.
+    """
+    try:
+        return _music_retrieval(query, instrument, measure_number, title, file_name)[0]
+    except Exception as e:
+        return f"Error querying RAG: {str(e)}"
+
+def cached_music_retrieval(query: str, instrument: Optional[str] = None, measure_number: Optional[int] = None,
+                           title: Optional[str] = None, file_name: Optional[str] = None) -> str:
+    """music_retrieval behind the semantic answer cache.
+
+    A question close enough to an earlier one (cosine similarity of their
+    embeddings) is answered from the cache, as long as the index has not
+    changed since. Exact measure lookups skip the cache and the embedding.
+    """
+    try:
+        exact = _exact_lookup(instrument, measure_number, title, file_name)
+        if exact:
+            return exact[0]
+    except Exception as e:
+        return f"Error querying RAG: {str(e)}"
+    if get_rag_engine() is None:
         return "RAG engine not initialized."
-    
-    refined_query = query
-    if instrument:
-        refined_query += f" (Instrument: {instrument})"
-    if measure_number:
-        refined_query += f" (Measure: {measure_number})"
-        
+    keys = {"instrument": instrument, "measure_number": measure_number, "title": title, "file_name": file_name}
+    cache = get_answer_cache()
+    # Read before answering so a re-index during the query discards the result
+    index_version = cache.index_version
     try:
-        response = engine.query(refined_query)
-        return str(response)
+        embedding = _query_embedding(query)
+        cached = cache.lookup(embedding, query, keys)
+        if cached is not None:
+            print(f"Answer cache hit (similarity {cached['similarity']:.3f}, cached query {cached['query']!r})")
+            return cached["answer"]
+        answer, node_ids = _vector_retrieval(QueryBundle(query_str=query, embedding=embedding),
+                                             build_metadata_filters(instrument, measure_number, title, file_name))
     except Exception as e:
         return f"Error querying RAG: {str(e)}"
+    cache.put(query, embedding, node_ids, answer, index_version, keys)
+    return answer
+
+def _citation(node_id: str, metadata: Dict[str, Any], score: Optional[float] = None) -> Dict[str, Any]:
+    """What the chat UI shows for a chunk an answer was built from."""
+    return {
+        "id": node_id,
+        "title": metadata.get("title"),
+        "file_name": metadata.get("file_name"),
+        "instrument": metadata.get("instrument"),
+        "measure_start": metadata.get("measure_start", metadata.get("measure_number")),
+        "measure_end": metadata.get("measure_end", metadata.get("measure_number")),
+        "score": score,
+    }
+
+def _node_citations(nodes: List[NodeWithScore]) -> List[Dict[str, Any]]:
+    return [_citation(node.node.node_id, node.node.metadata, node.score) for node in nodes]
+
+def _stored_citations(node_ids: List[str]) -> List[Dict[str, Any]]:
+    """Citations for chunk ids, from the measure store."""
+    rows = get_measure_store().get(node_ids)
+    return [_citation(node_id, rows[node_id]["metadata"]) for node_id in node_ids if node_id in rows]
+
+def stream_music_retrieval(query: str, instrument: Optional[str] = None, measure_number: Optional[int] = None,
+                           title: Optional[str] = None, file_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """cached_music_retrieval as events: the retrieved chunks first, then answer tokens.
+
+    Yields {"type": "sources", "sources": [...]} once retrieval is done and
+    {"type": "token", "text": ...} as the synthesizer produces text, so the
+    first bytes only wait for retrieval.
+    """
+    exact = _exact_lookup(instrument, measure_number, title, file_name)
+    if exact:
+        answer, node_ids = exact
+        yield {"type": "sources", "sources": _stored_citations(node_ids)}
+        yield {"type": "token", "text": answer}
+        return
+    engine = get_rag_engine(build_metadata_filters(instrument, measure_number, title, file_name), streaming=True)
+    keys = {"instrument": instrument, "measure_number": measure_number, "title": title, "file_name": file_name}
+    cache = get_answer_cache()
+    # Read before answering so a re-index during the query discards the result
+    index_version = cache.index_version
+    embedding = _query_embedding(query)
+    cached = cache.lookup(embedding, query, keys)
+    if cached is not None:
+        print(f"Answer cache hit (similarity {cached['similarity']:.3f}, cached query {cached['query']!r})")
+        yield {"type": "sources", "sources": _stored_citations(cached["node_ids"]), "cached": True}
+        yield {"type": "token", "text": cached["answer"]}
+        return
+
+    query_bundle = QueryBundle(query_str=query, embedding=embedding)
+    nodes = engine.retrieve(query_bundle)
+    yield {"type": "sources", "sources": _node_citations(nodes)}
+    response = engine.synthesize(query_bundle, nodes)
+    tokens = getattr(response, "response_gen", None) or [str(response)]
+    answer = []
+    for token in tokens:
+        answer.append(token)
+        yield {"type": "token", "text": token}
+    cache.put(query, embedding, [node.node.node_id for node in nodes], "".join(answer), index_version, keys)
+
+def melody_search(fragment: str, limit: int = 5) -> str:
+    """
+    Finds the hymns a melody fragment comes from.
+
+    The fragment is a note sequence ("E D C D E E E", octaves optional) or an
+    ABC snippet; matching is by intervals, so any transposition is found.
+    """
+    pitches = parse_fragment(fragment)[0]
+    if len(pitches) < NGRAM + 1:
+        return f"Please give at least {NGRAM + 1} notes to search for a melody."
+    results = search_melody(fragment, limit=limit)
+    if not results:
+        return f"No score contains the melody {fragment!r}."
+    lines = [f"Scores containing the melody {fragment!r}:"]
+    for result in results:
+        span = (f"measure {result['measure_start']}" if result["measure_start"] == result["measure_end"]
+                else f"measures {result['measure_start']}-{result['measure_end']}")
+        lines.append(f"- {result['title']} ({result['file_name']}), {result['instrument']}, {span}: "
+                     f"{result['matched_ngrams']}/{result['query_ngrams']} n-grams matched")
+    return "\n".join(lines)
+
+def similar_hymns(score: str, limit: int = 5) -> str:
+    """
+    Lists the hymns whose melodies are most similar to the given score
+    (file name, file name without extension, or title).
+    """
+    results = similar_scores(score, limit=limit)
+    if results is None:
+        return f"I don't know a score called {score!r}."
+    if not results:
+        return f"No other hymns to compare {score!r} with yet."
+    lines = [f"Hymns that sound like {score}:"]
+    lines += [f"- {result['title']} ({result['file_name']}), similarity {result['similarity']:.2f}" for result in results]
+    return "\n".join(lines)
+
+def lyrics_search(text: str, limit: int = 5) -> str:
+    """
+    Finds the hymns and measures whose lyrics contain the given text
+    (Korean or any other language; spacing and punctuation are ignored).
+    """
+    results = search_lyrics(text, limit=limit)
+    if not results:
+        return f"No hymn lyrics contain {text!r}."
+    lines = [f"Lyrics matching {text!r}:"]
+    for result in results:
+        span = (f"measure {result['measure_start']}" if result["measure_start"] == result["measure_end"]
+                else f"measures {result['measure_start']}-{result['measure_end']}")
+        match = "" if result["exact"] else " (approximate)"
+        lines.append(f"- {result['title']} ({result['file_name']}), verse {result['verse']}, {span}{match}: "
+                     f"{result['text']}")
+    return "\n".join(lines)
+
+# A quoted line of text, e.g. 「나는 굳게 믿나이다」 or "hinterm Dorfe steht". The ASCII
+# apostrophe is left out: in "what's the hymn with 'Ave'" it would open a quote at "'s"
+_QUOTED_RE = re.compile(r'["“「『‘]([^"”」』’]{2,})["”」』’]')
+
+# "Which hymns sound like Der Leiermann?", "hymns similar to 001.xml"
+_SIMILAR_RE = re.compile(r"sounds?\s+like|similar\s+to", re.IGNORECASE)
 
 class SimpleAgent:
     """Simple agent that wraps RAG queries without complex LangChain dependencies."""
     
+    def _index_answer(self, user_message: str) -> Optional[str]:
+        """Answer from the melody, lyrics or similarity index, if the question is for one of them."""
+        # Questions quoting a melody go to the melody index, not the vector store
+        fragment = find_melody_fragment(user_message)
+        if fragment:
+            return melody_search(fragment)
+        for quoted in _QUOTED_RE.finditer(user_message):
+            if any(result["exact"] for result in search_lyrics(quoted.group(1), limit=1)):
+                return lyrics_search(quoted.group(1))
+        similar = _SIMILAR_RE.search(user_message)
+        if similar:
+            score = user_message[similar.end():].strip(" ?!.\"'")
+            if score and similar_scores(score) is not None:
+                return similar_hymns(score)
+        return None
+
     def invoke(self, inputs: dict):
         """Process user input and return response."""
         user_message = inputs.get("input", "")
         
+        answer = self._index_answer(user_message)
+        if answer is not None:
+            return {"output": answer}
+        keys = extract_query_keys(user_message)
+        
         # Check if we have an API key for full LLM responses
         if not os.environ.get("OPENAI_API_KEY"):
             # Use RAG only mode
             try:
-                rag_response = music_retrieval(user_message)
+                rag_response = cached_music_retrieval(user_message, **keys)
                 return {
                     "output": f"[RAG Response - No LLM]\n\n{rag_response}\n\nNote: For better responses, please provide an OpenAI API key."
                 }
@@ -55,11 +366,31 @@ class SimpleAgent:
         # If we have an API key, we could use full LangChain here
         # For now, still use RAG only
         try:
-            rag_response = music_retrieval(user_message)
+            rag_response = cached_music_retrieval(user_message, **keys)
             return {"output": rag_response}
         except Exception as e:
             return {"output": f"Error: {str(e)}"}
 
+    def stream(self, inputs: dict) -> Iterator[Dict[str, Any]]:
+        """invoke as events: "sources", then "token"s, then "done" (or "error")."""
+        user_message = inputs.get("input", "")
+        try:
+            answer = self._index_answer(user_message)
+            if answer is not None:
+                yield {"type": "sources", "sources": []}
+                yield {"type": "token", "text": answer}
+            else:
+                no_llm = not os.environ.get("OPENAI_API_KEY")
+                for event in stream_music_retrieval(user_message, **extract_query_keys(user_message)):
+                    yield event
+                    if no_llm and event["type"] == "sources":
+                        yield {"type": "token", "text": "[RAG Response - No LLM]\n\n"}
+                if no_llm:
+                    yield {"type": "token", "text": "\n\nNote: For better responses, please provide an OpenAI API key."}
+        except Exception as e:
+            yield {"type": "error", "detail": str(e)}
+        yield {"type": "done"}
+
 def create_clef_agent():
     """Creates and returns a simple agent."""
     return SimpleAgent()
@@ -0,0 +1,177 @@
+"""
+Semantic answer cache in front of the agent.
+
+Choir members ask the same questions in slightly different words ("notes of
+bass measure 3 in der-leiermann" / "what does the bass sing in bar 3 of
+der-leiermann?"). Answers are cached with the embedding of the question
+that produced them; a new question whose embedding is within a cosine
+similarity threshold of a cached one gets the cached answer without any
+retrieval or LLM call.
+
+Embeddings of questions that differ only in a measure number or part ("bass
+measure 5" / "tenor measure 6") are nearly identical, so a hit also
+requires the numbers, part names and quoted titles of both questions to
+match exactly, as well as the score, part and measure the agent extracted
+from them (unquoted titles and file names are only caught there).
+
+Every entry records the index version it was computed against. Ingestion
+calls invalidate() whenever indexed chunks change, which bumps the version
+and drops all entries, so answers never outlive the scores they came from.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+ANSWER_CACHE_SIZE = int(os.environ.get("CLEF_ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("CLEF_ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# Voice and instrument names that select a part; questions naming different ones never share answers
+PART_TERMS = frozenset({
+    "soprano", "mezzo", "alto", "contralto", "tenor", "baritone", "bass", "voice", "melody",
+    "piano", "organ", "keyboard", "violin", "viola", "cello", "flute", "oboe", "clarinet",
+    "bassoon", "horn", "trumpet", "trombone", "guitar", "harp",
+    "treble", "left", "right", "upper", "lower",
+    "소프라노", "메조", "알토", "테너", "바리톤", "베이스", "반주", "오르간", "피아노",
+})
+_NUMBER_RE = re.compile(r"\d+")
+_WORD_RE = re.compile(r"\w+")
+_QUOTED_RE = re.compile(r'["“「『]([^"”」』]+)["”」』]')
+
+def key_terms(query: str) -> Tuple[Tuple[str, ...], FrozenSet[str], FrozenSet[str]]:
+    """Numbers, part names and quoted phrases of a question, which a cached answer must share."""
+    folded = query.casefold()
+    numbers = tuple(str(int(number)) for number in _NUMBER_RE.findall(folded))
+    words = _WORD_RE.findall(folded)
+    # "basses", "tenors", "베이스가": match a part name at the start of a word
+    parts = frozenset(term for word in words for term in PART_TERMS if word.startswith(term))
+    quoted = frozenset(phrase.strip() for phrase in _QUOTED_RE.findall(folded))
+    return numbers, parts, quoted
+
+def _entry_key(query: str, keys: Optional[Dict[str, Any]]) -> Tuple[Any, ...]:
+    """key_terms plus the retrieval keys (score, part, measure) extracted from the question."""
+    extracted = frozenset((name, value.casefold() if isinstance(value, str) else value)
+                          for name, value in (keys or {}).items() if value is not None)
+    return key_terms(query) + (extracted,)
+
+class SemanticAnswerCache:
+    """Bounded LRU of (query embedding, retrieved node ids, answer). Thread-safe."""
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        # Stacked unit vectors of all entries, rebuilt lazily after changes
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        self.index_version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float], query: str,
+               keys: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Most similar cached entry within the threshold whose key terms match the query's, or None.
+
+        keys are the retrieval filters of the question (title, file_name,
+        instrument, measure_number); they must equal the cached entry's.
+        Returned dicts hold answer, node_ids, similarity and query.
+        """
+        if self.max_size <= 0:
+            return None
+        vector = self._unit(embedding)
+        terms = _entry_key(query, keys)
+        with self._lock:
+            if self._entries and self._matrix is None:
+                self._matrix_ids = list(self._entries)
+                self._matrix = np.stack([self._entries[i]["vector"] for i in self._matrix_ids])
+            best = None
+            if self._entries and self._matrix.shape[1] == vector.shape[0]:
+                similarities = self._matrix @ vector
+                for position in np.argsort(-similarities):
+                    if similarities[position] < self.threshold:
+                        break
+                    if self._entries[self._matrix_ids[position]]["terms"] == terms:
+                        best = (self._matrix_ids[position], float(similarities[position]))
+                        break
+            if best is None:
+                self.misses += 1
+                return None
+            entry_id, similarity = best
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            entry = self._entries[entry_id]
+            return {"answer": entry["answer"], "node_ids": entry["node_ids"],
+                    "similarity": similarity, "query": entry["query"]}
+
+    def put(self, query: str, embedding: List[float], node_ids: List[str], answer: Any, index_version: int,
+            keys: Optional[Dict[str, Any]] = None):
+        """Cache an answer computed against index_version, with the retrieval keys it was computed for.
+
+        Answers computed before the latest invalidation are dropped, so a
+        question that raced a re-index never caches a stale answer.
+        """
+        if self.max_size <= 0:
+            return
+        vector = self._unit(embedding)
+        with self._lock:
+            if index_version != self.index_version:
+                return
+            self._entries[self._next_id] = {
+                "query": query, "terms": _entry_key(query, keys), "vector": vector,
+                "node_ids": list(node_ids), "answer": answer,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate(self):
+        """Drop every entry and bump the index version (called on re-index)."""
+        with self._lock:
+            self.index_version += 1
+            self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "index_version": self.index_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+_cache: Optional[SemanticAnswerCache] = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Process-wide answer cache, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticAnswerCache()
+        return _cache
+
+def invalidate_answer_cache():
+    """Invalidate cached answers after indexed chunks changed."""
+    get_answer_cache().invalidate()
@@ -0,0 +1,79 @@
+"""
+Measure how many tokens each MusicXMLReader text encoding sends to the
+embedding model.
+
+Usage: python compare_encodings.py [data_dir] [--chunking measure|window|vertical]
+
+Counts use tiktoken's cl100k_base (the OpenAI embedding tokenizer) when it is
+installed and its BPE file can be loaded, otherwise a word/punctuation
+approximation; the counter used is printed first.
+"""
+
+import os
+import re
+import sys
+import argparse
+from pathlib import Path
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llama_index.core.schema import MetadataMode
+from rag_indexer import MusicXMLReader, ENCODINGS, CHUNKING_STRATEGIES
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoder = None
+TOKENIZER = "approximate (tiktoken not installed)"
+if tiktoken is not None:
+    try:
+        _encoder = tiktoken.get_encoding("cl100k_base")
+        TOKENIZER = "cl100k_base"
+    except Exception as e:
+        # The BPE file is downloaded on first use, which fails offline
+        TOKENIZER = f"approximate (cl100k_base unavailable: {e})"
+
+def count_tokens(text: str) -> int:
+    if _encoder is not None:
+        return len(_encoder.encode(text))
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("data_dir", nargs="?", default="../MusicXML_test")
+    parser.add_argument("--chunking", choices=CHUNKING_STRATEGIES, default="measure")
+    parser.add_argument("--backend", default="etree")
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    files = sorted(list(data_dir.glob("*.xml")) + list(data_dir.glob("*.mxl")))
+    if not files:
+        print(f"No MusicXML files in {data_dir}")
+        return
+
+    print(f"{len(files)} files, chunking={args.chunking}, tokenizer={TOKENIZER}\n")
+    print(f"{'encoding':<10} {'chunks':>8} {'tokens':>10} {'tokens/chunk':>13}")
+    baseline = None
+    for encoding in ENCODINGS:
+        reader = MusicXMLReader(backend=args.backend, chunking=args.chunking, encoding=encoding)
+        chunks = 0
+        tokens = 0
+        for file_path in files:
+            try:
+                docs = reader.load_data(file_path)
+            except Exception as e:
+                print(f"Skipping {file_path.name}: {e}")
+                continue
+            for doc in docs:
+                chunks += 1
+                # What the embedding model actually sees, metadata included
+                tokens += count_tokens(doc.get_content(metadata_mode=MetadataMode.EMBED))
+        baseline = baseline or tokens
+        per_chunk = tokens / chunks if chunks else 0
+        print(f"{encoding:<10} {chunks:>8} {tokens:>10} {per_chunk:>13.1f}  ({tokens / baseline:.0%} of verbose)")
+
+if __name__ == "__main__":
+    main()
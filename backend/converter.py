@@ -30,6 +30,7 @@ def convert_musicxml_to_abc(xml_file_path: str) -> str:
         target_file = xml_file_path
         if xml_file_path.endswith('.mxl'):
             print(f"Converting MXL to XML: {xml_file_path}")
+            # Unchanged files come from music21's own pickle cache
             score = music21.converter.parse(xml_file_path)
             temp_xml_path = xml_file_path.replace('.mxl', '.xml')
             score.write('xml', fp=temp_xml_path)
@@ -0,0 +1,171 @@
+"""
+Content-addressed cache of text embeddings.
+
+Hymns repeat a lot (verses, refrains, identical accompaniment measures) and
+re-uploads produce exactly the same measure texts again, so most embedding
+calls during indexing are for texts that were embedded before. Embeddings are
+stored in SQLite keyed by (embedding model id, hash of the normalized text)
+and consulted before the embedding model is called.
+
+Query embeddings are cached separately, in memory, by QueryEmbeddingCache.
+"""
+
+import os
+import re
+import sqlite3
+import hashlib
+import time
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.environ.get("CLEF_EMBEDDING_CACHE", os.path.join(BACKEND_DIR, "data", "cache", "embeddings.sqlite3"))
+QUERY_CACHE_SIZE = int(os.environ.get("CLEF_QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("CLEF_QUERY_CACHE_TTL", "3600"))
+
+def _text_hash(text: str) -> str:
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Thread-safe on-disk embedding cache with hit/miss counters."""
+
+    def __init__(self, path: str = CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, embedding BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model_id: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model_id, *chunk],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model_id: str, items: Dict[str, List[float]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding) VALUES (?, ?, ?)",
+                [(model_id, text_hash, array("f", embedding).tobytes()) for text_hash, embedding in items.items()],
+            )
+            self._conn.commit()
+
+    def embed(self, texts: List[str], embed_fn: Callable[[List[str]], List[List[float]]], model_id: str) -> List[List[float]]:
+        """Return embeddings for texts, calling embed_fn only for unseen texts."""
+        hashes = [_text_hash(text) for text in texts]
+        cached = self.get_many(model_id, list(set(hashes)))
+
+        # Embed each distinct missing text once, even if it repeats in the batch
+        missing: Dict[str, str] = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        if missing:
+            new_embeddings = embed_fn(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_embeddings))
+            self.put_many(model_id, computed)
+            cached.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[text_hash] for text_hash in hashes]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache, created on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+class QueryEmbeddingCache:
+    """Bounded in-memory LRU of query text -> embedding with a TTL. Thread-safe.
+
+    Repeated and popular questions skip the embedding model entirely. Keys
+    ignore case and whitespace differences.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl_seconds: float = QUERY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, text: str, embed_fn: Callable[[str], List[float]], model_id: str) -> List[float]:
+        key = (model_id, _text_hash(text.casefold()))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Embed outside the lock so slow model calls don't serialize lookups
+        embedding = embed_fn(text)
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return embedding
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+_query_cache: Optional[QueryEmbeddingCache] = None
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Process-wide query embedding cache, created on first use."""
+    global _query_cache
+    with _cache_lock:
+        if _query_cache is None:
+            _query_cache = QueryEmbeddingCache()
+        return _query_cache
@@ -0,0 +1,281 @@
+"""
+Lightweight MusicXML measure extractor built on ElementTree.
+
+MusicXMLReader only needs pitches, duration types, lyrics, dynamics and text
+expressions per measure, so building a full music21 object model for every
+score is mostly wasted work. This module streams the MusicXML (or the score
+inside an .mxl zip) with iterparse and emits the same per-measure content,
+clearing each measure as soon as it has been read so memory stays small.
+The direct-XML approach follows xml2abc.py.
+
+extract_score() returns a plain dict shared with the music21 backend:
+
+    {"title": str | None, "composer": str | None,
+     "key": str | None, "meter": str | None,
+     "parts": [{"name": str, "measures": [{"number": int,
+                                           "notes": [{"pitches": [...], "type": str, "offset": float,
+                                                      "lyric": str | None,
+                                                      "lyrics": [{"verse": str, "syllabic": str, "text": str}]}],
+                                           "dynamics": [...]}]}]}
+"""
+
+import re
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import xml.etree.cElementTree as E
+except ImportError:
+    import xml.etree.ElementTree as E
+
+class UnsupportedScoreError(ValueError):
+    """Raised for MusicXML layouts this extractor does not handle (e.g. timewise)."""
+
+_ALTER_SUFFIX = {1: "#", 2: "##", -1: "-", -2: "--"}
+
+# Largest duration type not longer than a quarter length, as music21 reports it
+_TYPE_BY_QL = [
+    (16.0, "longa"), (8.0, "breve"), (4.0, "whole"), (2.0, "half"), (1.0, "quarter"),
+    (0.5, "eighth"), (0.25, "16th"), (0.125, "32nd"), (0.0625, "64th"),
+]
+
+# Tonic of the major and minor key for each number of fifths, spelled as music21 names keys
+_MAJOR_TONICS = ["C-", "G-", "D-", "A-", "E-", "B-", "F", "C", "G", "D", "A", "E", "B", "F#", "C#"]
+_MINOR_TONICS = ["a-", "e-", "b-", "f", "c", "g", "d", "a", "e", "b", "f#", "c#", "g#", "d#", "a#"]
+
+def _open_score(file_path: Path):
+    """Return a binary file object for the MusicXML document."""
+    if file_path.suffix.lower() != ".mxl":
+        return open(file_path, "rb")
+    archive = zipfile.ZipFile(file_path)
+    rootfile = None
+    if "META-INF/container.xml" in archive.namelist():
+        container = E.fromstring(archive.read("META-INF/container.xml"))
+        for elem in container.iter():
+            if elem.tag.endswith("rootfile") and elem.get("full-path"):
+                rootfile = elem.get("full-path")
+                break
+    if rootfile is None:
+        candidates = [n for n in archive.namelist() if n.endswith((".xml", ".musicxml")) and not n.startswith("META-INF")]
+        if not candidates:
+            raise UnsupportedScoreError(f"No MusicXML document inside {file_path.name}")
+        rootfile = candidates[0]
+    return archive.open(rootfile)
+
+def _text(elem, path: str) -> Optional[str]:
+    child = elem.find(path)
+    if child is None or child.text is None:
+        return None
+    return child.text.strip() or None
+
+def _key_name(key) -> Optional[str]:
+    """"G major" / "e minor" from a <key> element, like music21's Key.name."""
+    try:
+        fifths = int(_text(key, "fifths") or "")
+    except ValueError:
+        return None
+    if not -7 <= fifths <= 7:
+        return None
+    if _text(key, "mode") == "minor":
+        return f"{_MINOR_TONICS[fifths + 7]} minor"
+    return f"{_MAJOR_TONICS[fifths + 7]} major"
+
+def _meter(time) -> Optional[str]:
+    beats, beat_type = _text(time, "beats"), _text(time, "beat-type")
+    return f"{beats}/{beat_type}" if beats and beat_type else None
+
+def _measure_number(raw: Optional[str]) -> int:
+    match = re.match(r"\d+", raw or "")
+    return int(match.group()) if match else 0
+
+def _pitch_name(pitch) -> str:
+    step = _text(pitch, "step") or "C"
+    octave = _text(pitch, "octave") or "4"
+    try:
+        alter = round(float(_text(pitch, "alter") or 0))
+    except ValueError:
+        alter = 0
+    return f"{step}{_ALTER_SUFFIX.get(alter, '')}{octave}"
+
+def _duration_type(note, divisions: int) -> str:
+    type_text = _text(note, "type")
+    if type_text:
+        return type_text
+    duration = _text(note, "duration")
+    if not duration or not divisions:
+        return "zero"
+    ql = float(duration) / divisions
+    for limit, name in _TYPE_BY_QL:
+        if ql >= limit:
+            return name
+    return "complex"
+
+def _lyric(note) -> Optional[str]:
+    # music21's Note.lyric joins all verses with newlines
+    texts = [_text(lyric, "text") for lyric in note.findall("lyric")]
+    texts = [t for t in texts if t]
+    return "\n".join(texts) if texts else None
+
+def _lyric_syllables(note) -> List[Dict[str, str]]:
+    """Every verse's syllable on a note, with its syllabic (begin/middle/end/single)."""
+    syllables = []
+    for lyric in note.findall("lyric"):
+        text = _text(lyric, "text")
+        if text:
+            syllables.append({
+                "verse": lyric.get("number") or "1",
+                "syllabic": _text(lyric, "syllabic") or "single",
+                "text": text,
+            })
+    return syllables
+
+# Sort order of music21's classes at equal offsets (TextExpression before Dynamic)
+_WORDS_ORDER = -30
+_DYNAMIC_ORDER = 10
+# Texts music21 turns into repeat marks (repeat.repeatExpressionReference) rather than TextExpressions
+_REPEAT_TEXTS = {
+    "coda", "tocoda", "alcoda", "segno", "fine", "dacapo", "dc", "dacapoalfine", "dcalfine",
+    "dacapoalcoda", "dcalcoda", "alsegno", "dalsegno", "ds", "dalsegnoalfine", "dsalfine",
+    "dalsegnoalcoda", "dsalcoda",
+}
+
+def _direction_texts(direction) -> List[Tuple[int, str]]:
+    """(class sort order, text) of the dynamics and words of a <direction>, as music21 reads them."""
+    texts = []
+    for direction_type in direction.findall("direction-type"):
+        for dynamics in direction_type.findall("dynamics"):
+            for mark in dynamics:
+                # music21 only reads the text of "other-dynamic", so <other-dynamics> keeps its tag
+                texts.append((_DYNAMIC_ORDER, mark.tag))
+        for words in direction_type.findall("words"):
+            # Whitespace-only words still become an (empty) TextExpression
+            text = (words.text or "").strip()
+            if text.replace(" ", "").replace(".", "").lower() not in _REPEAT_TEXTS:
+                texts.append((_WORDS_ORDER, text))
+    return texts
+
+def _read_measure(measure, state: Dict[str, Any], staves: int) -> List[Dict[str, Any]]:
+    """Extract one <measure> into one measure dict per staff."""
+    number = _measure_number(measure.get("number"))
+    # (offset, order, item) so voices interleave by time like measure.flatten()
+    notes = [[] for _ in range(staves)]
+    dynamics = [[] for _ in range(staves)]
+    position = 0
+    last_onset = 0
+    order = 0
+
+    for elem in measure:
+        order += 1
+        if elem.tag == "attributes":
+            divisions = _text(elem, "divisions")
+            if divisions:
+                state["divisions"] = int(float(divisions))
+        elif elem.tag == "backup":
+            position -= int(float(_text(elem, "duration") or 0))
+        elif elem.tag == "forward":
+            position += int(float(_text(elem, "duration") or 0))
+        elif elem.tag == "direction":
+            staff = min(int(_text(elem, "staff") or 1), staves) - 1
+            onset = position + int(float(_text(elem, "offset") or 0))
+            for class_order, text in _direction_texts(elem):
+                dynamics[staff].append((onset, class_order, order, text))
+        elif elem.tag == "note":
+            is_chord_tone = elem.find("chord") is not None
+            duration = 0 if elem.find("grace") is not None else int(float(_text(elem, "duration") or 0))
+            onset = last_onset if is_chord_tone else position
+            if not is_chord_tone:
+                last_onset = position
+                position += duration
+
+            pitch = elem.find("pitch")
+            if pitch is None:
+                # Rests and unpitched percussion are not Notes in music21 either
+                continue
+            staff = min(int(_text(elem, "staff") or 1), staves) - 1
+            staff_notes = notes[staff]
+            name = _pitch_name(pitch)
+            if is_chord_tone and staff_notes and staff_notes[-1][0] == onset:
+                chord = staff_notes[-1][2]
+                chord["pitches"].append(name)
+                # Lyrics of chords are not collected, matching the music21 backend
+                chord["lyric"] = None
+                chord["lyrics"] = []
+            else:
+                staff_notes.append((onset, order, {
+                    "pitches": [name],
+                    "type": _duration_type(elem, state.get("divisions", 1)),
+                    "offset": round(onset / state.get("divisions", 1), 4),
+                    "lyric": _lyric(elem),
+                    "lyrics": _lyric_syllables(elem),
+                }))
+
+    return [
+        {
+            "number": number,
+            "notes": [item for _, _, item in sorted(notes[staff], key=lambda x: (x[0], x[1]))],
+            "dynamics": [item[-1] for item in sorted(dynamics[staff], key=lambda x: x[:3])],
+        }
+        for staff in range(staves)
+    ]
+
+def _count_staves(part) -> int:
+    for attributes in part.iter("attributes"):
+        staves = _text(attributes, "staves")
+        if staves:
+            return max(1, int(staves))
+    return 1
+
+def extract_score(file_path: Path) -> Dict[str, Any]:
+    """Stream a MusicXML/.mxl file into the per-measure score dict."""
+    file_path = Path(file_path)
+    title = None
+    composer = None
+    key = None
+    meter = None
+    part_names: Dict[str, str] = {}
+    parts: List[Dict[str, Any]] = []
+
+    with _open_score(file_path) as source:
+        context = E.iterparse(source, events=("start", "end"))
+        part_staves: List[Dict[str, Any]] = []
+        state: Dict[str, Any] = {}
+        staves = 1
+
+        for event, elem in context:
+            tag = elem.tag
+            if event == "start":
+                if tag == "score-timewise":
+                    raise UnsupportedScoreError("Timewise MusicXML is not supported by the fast reader")
+                if tag == "part":
+                    name = part_names.get(elem.get("id"), "") or "Unknown Instrument"
+                    part_staves = []
+                    state = {}
+                    staves = 0
+                    current_name = name
+                continue
+
+            if tag == "work-title" and title is None:
+                title = (elem.text or "").strip() or None
+            elif tag == "creator" and elem.get("type") == "composer" and composer is None:
+                composer = (elem.text or "").strip() or None
+            elif tag == "key" and key is None:
+                key = _key_name(elem)
+            elif tag == "time" and meter is None:
+                meter = _meter(elem)
+            elif tag == "score-part":
+                part_names[elem.get("id")] = _text(elem, "part-name") or ""
+                elem.clear()
+            elif tag == "measure":
+                if not staves:
+                    # Multi-staff parts (piano) are split per staff, like music21 PartStaffs
+                    staves = _count_staves(elem)
+                    part_staves = [{"name": current_name, "measures": []} for _ in range(staves)]
+                for staff, measure in enumerate(_read_measure(elem, state, staves)):
+                    part_staves[staff]["measures"].append(measure)
+                elem.clear()
+            elif tag == "part":
+                parts.extend(part_staves)
+                elem.clear()
+
+    return {"title": title, "composer": composer, "key": key, "meter": meter, "parts": parts}
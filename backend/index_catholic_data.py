@@ -43,7 +43,8 @@ def main():
     
     # Index the files
     try:
-        index = get_index(data_dir="data/Catholic", persist_dir="data/chromadb")
+        # Full rebuilds are CPU-bound in music21; parse on every core
+        index = get_index(data_dir="data/Catholic", persist_dir="data/chromadb", workers=os.cpu_count())
         if index:
             print("\n✓ Indexing completed successfully!")
             print("The RAG system is ready to use.")
@@ -0,0 +1,104 @@
+"""
+Process-wide registry of Chroma clients, collections and index handles.
+
+The API and the agent used to build their own indexes over the same
+persisted collection (main.py from data/Catholic, the agent from
+../MusicXML_test), and every get_index call opened a new Chroma client.
+Here there is one client per persist directory, one collection object per
+name and one VectorStoreIndex handle over the chunk collection, and each
+corpus directory is synced into it (parsed, diffed, embedded) at most once
+per process, so every caller shares the same handles. Queries read the
+published handle without taking any lock.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import chromadb
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+PERSIST_DIR = "data/chromadb"
+CHUNK_COLLECTION = "catholic_hymns"
+# Corpus directories synced into the shared index, relative to the backend dir
+CORPORA = [d.strip() for d in os.environ.get("CLEF_CORPORA", "data/Catholic,../MusicXML_test").split(",") if d.strip()]
+
+_clients: Dict[str, Any] = {}
+_collections: Dict[Tuple[str, str], Any] = {}
+_indexes: Dict[str, Any] = {}
+# (corpus dir, persist dir) -> whether it had any scores, once synced
+_synced: Dict[Tuple[str, str], bool] = {}
+# Published index handles per persist dir, read without locking
+_shared: Dict[str, Any] = {}
+_lock = threading.RLock()
+# Held for a whole corpus sync; callers wanting the same corpus wait instead of syncing it twice
+_sync_lock = threading.Lock()
+
+def _resolve(path: str) -> str:
+    return os.path.normpath(os.path.join(BACKEND_DIR, path))
+
+def get_chroma_client(persist_dir: str = PERSIST_DIR):
+    """The Chroma client for a persist directory, opened once per process."""
+    db_path = _resolve(persist_dir)
+    with _lock:
+        if db_path not in _clients:
+            _clients[db_path] = chromadb.PersistentClient(path=db_path)
+        return _clients[db_path]
+
+def get_collection(name: str, persist_dir: str = PERSIST_DIR, **kwargs):
+    """A named collection (created if missing), shared by every caller."""
+    key = (_resolve(persist_dir), name)
+    with _lock:
+        if key not in _collections:
+            _collections[key] = get_chroma_client(persist_dir).get_or_create_collection(name, **kwargs)
+        return _collections[key]
+
+def get_vector_index(persist_dir: str = PERSIST_DIR):
+    """The VectorStoreIndex over the chunk collection, without syncing any corpus."""
+    from llama_index.core import VectorStoreIndex
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+    from rag_indexer import configure_settings
+
+    db_path = _resolve(persist_dir)
+    with _lock:
+        if db_path not in _indexes:
+            configure_settings()
+            vector_store = ChromaVectorStore(chroma_collection=get_collection(CHUNK_COLLECTION, persist_dir))
+            _indexes[db_path] = VectorStoreIndex.from_vector_store(vector_store)
+        return _indexes[db_path]
+
+def sync_corpora(corpora: Optional[List[str]] = None, persist_dir: str = PERSIST_DIR, force: bool = False):
+    """Sync corpus directories into the shared index and publish the handle.
+
+    Each corpus is synced once per process; a missing or empty one is
+    remembered as such and not retried unless force is set. Called by the
+    startup warmup; queries only read the published handle.
+    """
+    from rag_indexer import get_index
+
+    db_path = _resolve(persist_dir)
+    with _sync_lock:
+        for data_dir in corpora if corpora is not None else CORPORA:
+            key = (_resolve(data_dir), db_path)
+            if force or key not in _synced:
+                _synced[key] = get_index(data_dir=data_dir, persist_dir=persist_dir) is not None
+        _shared[db_path] = get_vector_index(persist_dir)
+        return _shared[db_path]
+
+def corpus_status(persist_dir: str = PERSIST_DIR) -> Dict[str, str]:
+    """Each corpus synced so far, as "synced" or "unavailable" (missing or empty)."""
+    db_path = _resolve(persist_dir)
+    with _sync_lock:
+        return {os.path.relpath(data_dir, BACKEND_DIR): "synced" if ok else "unavailable"
+                for (data_dir, path), ok in _synced.items() if path == db_path}
+
+def get_shared_index(persist_dir: str = PERSIST_DIR):
+    """The index shared by the API and the agent, with every configured corpus synced.
+
+    After the first sync this is a dictionary read without locking; before
+    it, callers wait for (or run) the sync.
+    """
+    index = _shared.get(_resolve(persist_dir))
+    if index is not None:
+        return index
+    return sync_corpora(persist_dir=persist_dir)
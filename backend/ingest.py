@@ -0,0 +1,145 @@
+"""
+Streaming ingestion pipeline: discover -> parse -> chunk -> embed -> write.
+
+Each stage runs in its own thread and hands work to the next one through a
+bounded queue, so at most a few batches of documents are in memory at any
+time no matter how large the corpus is. The write stage runs in the caller's
+thread and reports every fully written file, so progress can be committed
+(e.g. to the index manifest) as ingestion goes rather than at the end.
+"""
+
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+_DONE = object()
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    """Blocking put that gives up once the pipeline is being torn down."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def run_pipeline(
+    parsed: Iterable[Tuple[Path, List[Any], Optional[str]]],
+    embed: Callable[[List[Any]], None],
+    write: Callable[[List[Any]], None],
+    on_file_done: Callable[[Path, int, Optional[str]], None],
+    batch_size: int = 64,
+    queue_size: int = 4,
+) -> int:
+    """Stream parsed files through batching, embedding and writing.
+
+    Args:
+        parsed: Iterable of (file_path, docs, error) as produced by the parse stage.
+        embed: Attaches embeddings to a batch of docs in place.
+        write: Persists a batch of docs.
+        on_file_done: Called once per file after all its docs are written,
+            with the doc count and the parse error, if any.
+        batch_size: Documents per embed/write batch.
+        queue_size: Maximum batches waiting between two stages.
+
+    Returns:
+        int: Number of documents written.
+    """
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    parsed_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    batch_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    embedded_q: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def parse_stage():
+        try:
+            for result in parsed:
+                if stop.is_set():
+                    break
+                _put(parsed_q, result, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(parsed_q, _DONE, stop)
+
+    def chunk_stage():
+        # A batch is (docs, files finished in it)
+        docs: List[Any] = []
+        finished: List[Tuple[Path, int, Optional[str]]] = []
+        try:
+            while True:
+                item = _get(parsed_q, stop)
+                if item is _DONE:
+                    break
+                file_path, file_docs, error = item
+                if error:
+                    finished.append((file_path, 0, error))
+                    continue
+                remaining = file_docs
+                while remaining:
+                    room = batch_size - len(docs)
+                    docs.extend(remaining[:room])
+                    remaining = remaining[room:]
+                    if len(docs) >= batch_size:
+                        _put(batch_q, (docs, finished), stop)
+                        docs, finished = [], []
+                finished.append((file_path, len(file_docs), None))
+            if docs or finished:
+                _put(batch_q, (docs, finished), stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(batch_q, _DONE, stop)
+
+    def embed_stage():
+        try:
+            while True:
+                item = _get(batch_q, stop)
+                if item is _DONE:
+                    break
+                if item[0]:
+                    embed(item[0])
+                _put(embedded_q, item, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(embedded_q, _DONE, stop)
+
+    threads = [
+        threading.Thread(target=stage, name=f"ingest-{stage.__name__}", daemon=True)
+        for stage in (parse_stage, chunk_stage, embed_stage)
+    ]
+    for thread in threads:
+        thread.start()
+
+    written = 0
+    try:
+        while True:
+            item = _get(embedded_q, stop)
+            if item is _DONE:
+                break
+            docs, finished = item
+            write(docs)
+            written += len(docs)
+            for file_path, count, error in finished:
+                on_file_done(file_path, count, error)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return written
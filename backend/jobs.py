@@ -0,0 +1,110 @@
+"""
+Background processing of uploaded scores.
+
+Converting an upload to ABC (MXL round trip plus the xml2abc subprocess)
+and indexing it (music21 parse plus embedding every measure) can take far
+longer than a client waits for a response. /upload only stores the file and
+submits a job here; a small worker pool does the rest while /jobs/{id}
+reports the job's stage, how many measures are indexed so far, and finally
+the ABC preview and chunk count.
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+UPLOAD_WORKERS = int(os.environ.get("CLEF_UPLOAD_WORKERS", "2"))
+# Finished jobs kept for status queries; the oldest are forgotten first
+MAX_FINISHED_JOBS = int(os.environ.get("CLEF_MAX_FINISHED_JOBS", "256"))
+ABC_PREVIEW_CHARS = 200
+
+FINISHED_STAGES = ("done", "failed")
+
+class JobQueue:
+    """Upload jobs run on a thread pool, with their status kept in memory. Thread-safe."""
+
+    def __init__(self, workers: int = UPLOAD_WORKERS, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def submit(self, file_path: Path) -> str:
+        """Queue conversion and indexing of an uploaded file; returns the job id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "file_name": file_path.name,
+                "stage": "queued",
+                "progress": {"indexed": 0, "total": None},
+                "result": None,
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+        self._executor.submit(self._run, job_id, file_path)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A snapshot of the job's status, or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else {**job, "progress": dict(job["progress"])}
+
+    def _update(self, job_id: str, **fields: Any):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            if fields.get("stage") in FINISHED_STAGES:
+                self._jobs[job_id]["finished_at"] = time.time()
+                self._forget_finished_locked()
+
+    def _forget_finished_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["stage"] in FINISHED_STAGES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _progress(self, job_id: str, indexed: int, total: int):
+        with self._lock:
+            self._jobs[job_id]["progress"] = {"indexed": indexed, "total": total}
+
+    def _run(self, job_id: str, file_path: Path):
+        from converter import convert_musicxml_to_abc
+        from index_registry import get_shared_index
+        from rag_indexer import add_document_to_index
+
+        started = time.perf_counter()
+        try:
+            self._update(job_id, stage="converting")
+            abc_content = convert_musicxml_to_abc(str(file_path))
+
+            # Waits for startup to finish syncing the corpora if it has not yet
+            self._update(job_id, stage="indexing")
+            counts = add_document_to_index(file_path, get_shared_index(),
+                                           on_progress=lambda indexed, total: self._progress(job_id, indexed, total))
+
+            self._update(job_id, stage="done", result={
+                "abc_preview": abc_content[:ABC_PREVIEW_CHARS] + "..." if abc_content else "Conversion failed",
+                "chunks": counts["chunks"],
+                "embedded": counts["embedded"],
+            })
+            print(f"Upload job {job_id} ({file_path.name}) done in {time.perf_counter() - started:.1f} s")
+        except Exception as e:
+            print(f"Upload job {job_id} ({file_path.name}) failed: {e}")
+            self._update(job_id, stage="failed", error=str(e))
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Process-wide upload job queue, created on first use."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,134 @@
+"""
+BM25 inverted index over chunk texts.
+
+Measure texts are full of exact tokens - pitch names like F#4 or B-4,
+dynamics like mf, Korean lyric syllables - that a small English dense
+embedding model handles poorly. This index scores them lexically and is
+queried next to the vector retriever (see retrievers.HybridRetriever).
+
+The index lives in memory; it is built from the measure store on first use
+and kept current by ingestion through add()/remove().
+"""
+
+import re
+import math
+import heapq
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from measure_store import get_measure_store
+
+# Pitch names first so "F#4" and "B-4" survive as single tokens
+_TOKEN_RE = re.compile(r"[A-G](?:##|#|--|-)?\d|[가-힣]+|\w+", re.IGNORECASE)
+_HANGUL_RE = re.compile(r"[가-힣]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens; Hangul runs become syllable unigrams plus bigrams."""
+    tokens = []
+    for token in _TOKEN_RE.findall(text):
+        if _HANGUL_RE.fullmatch(token):
+            tokens.extend(token)
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            tokens.append(token.lower())
+    return tokens
+
+class BM25Index:
+    """Incrementally updatable Okapi BM25 index. Thread-safe."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_terms)
+
+    def add(self, doc_id: str, text: str):
+        terms = Counter(tokenize(text))
+        with self._lock:
+            self._remove_locked(doc_id)
+            self._doc_terms[doc_id] = terms
+            self._doc_lengths[doc_id] = sum(terms.values())
+            self._total_length += self._doc_lengths[doc_id]
+            for term, freq in terms.items():
+                self._postings[term][doc_id] = freq
+
+    def add_many(self, items: Iterable[Tuple[str, str]]):
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def _remove_locked(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, top_k: int = 10, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Best (doc_id, score) pairs for the query, highest score first.
+
+        With allowed, only those documents are scored (IDF stays corpus-wide),
+        so metadata filters restrict the ranking instead of thinning it out.
+        """
+        if allowed is not None and not allowed:
+            return []
+        terms = set(tokenize(query))
+        scores: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                if allowed is None:
+                    matches = postings.items()
+                elif len(allowed) < len(postings):
+                    matches = [(doc_id, postings[doc_id]) for doc_id in allowed if doc_id in postings]
+                else:
+                    matches = [(doc_id, freq) for doc_id, freq in postings.items() if doc_id in allowed]
+                for doc_id, freq in matches:
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+def get_lexical_index() -> BM25Index:
+    """Process-wide BM25 index, built from the measure store on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = BM25Index()
+            index.add_many(get_measure_store().iter_texts())
+            _index = index
+        return _index
+
+def update_lexical_index(docs: Iterable, removed_ids: Iterable[str]):
+    """Apply ingestion changes if the index is loaded; otherwise it is built fresh on first use."""
+    with _index_lock:
+        index = _index
+    if index is None:
+        return
+    for doc_id in removed_ids:
+        index.remove(doc_id)
+    index.add_many((doc.id_, doc.text) for doc in docs)
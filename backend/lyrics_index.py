@@ -0,0 +1,270 @@
+"""
+Full-text lyrics search at score level.
+
+MusicXML stores lyrics one syllable per note ("Drü-" "ben"), and chunk texts
+only hold the fragments of one measure of one part, so searching for a line
+of a (mostly Korean) hymn text through the vector store is fuzzy at best.
+Here each verse of each score is assembled into running text, joining
+syllables of a word (begin/middle/end) and skipping melisma notes, with the
+measure of every character kept alongside.
+
+Verses are indexed by character bigrams of their normalized text (case
+folded, spaces and punctuation removed), which suits Korean, where spacing
+varies and words are short, as well as Latin-script lyrics. A query is
+answered by intersecting posting lists and confirming the exact substring,
+which also yields the measure range it spans.
+"""
+
+import os
+import re
+import json
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.environ.get("CLEF_LYRICS_STORE", os.path.join(BACKEND_DIR, "data", "chromadb", "lyrics.sqlite3"))
+# Share of query bigrams a verse needs for an approximate match when no exact match exists
+FUZZY_MIN_OVERLAP = float(os.environ.get("CLEF_LYRICS_FUZZY_MIN", "0.6"))
+
+_IGNORED_RE = re.compile(r"[\W_]+")
+
+def normalize(text: str) -> Tuple[str, List[int]]:
+    """Case-folded text without spaces/punctuation, and each kept character's original index."""
+    chars, positions = [], []
+    for i, char in enumerate(text.casefold()):
+        if not _IGNORED_RE.fullmatch(char):
+            chars.append(char)
+            positions.append(i)
+    return "".join(chars), positions
+
+def assemble_verses(measures: List[Dict[str, Any]]) -> Dict[str, Tuple[str, List[int]]]:
+    """Running text of each verse of a part, with the measure number of every character.
+
+    Syllables continuing a word (after begin/middle) are joined without a
+    space; notes without a syllable (melismas, extensions) add nothing.
+    """
+    verses: Dict[str, Dict[str, Any]] = {}
+    for measure in measures:
+        for note in measure["notes"]:
+            for syllable in note.get("lyrics", []):
+                verse = verses.setdefault(syllable["verse"], {"text": [], "measures": [], "open": False})
+                joins_word = verse["open"] and syllable["syllabic"] in ("middle", "end")
+                if verse["text"] and not joins_word:
+                    verse["text"].append(" ")
+                    verse["measures"].append(measure["number"])
+                verse["text"].append(syllable["text"])
+                verse["measures"].extend([measure["number"]] * len(syllable["text"]))
+                verse["open"] = syllable["syllabic"] in ("begin", "middle")
+    return {number: ("".join(verse["text"]), verse["measures"]) for number, verse in verses.items()}
+
+def _bigrams(text: str) -> Set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+def _densest_span(text: str, grams: Set[str], width: int) -> Tuple[int, int, int]:
+    """The window of at most `width` characters holding the most distinct query bigrams.
+
+    Returns its start, end and how many distinct query bigrams it holds.
+    """
+    hits = [i for i in range(len(text) - 1) if text[i:i + 2] in grams]
+    if not hits:
+        return 0, 0, 0
+    in_window: Dict[str, int] = defaultdict(int)
+    best = (0, 0, 0)
+    first = 0
+    for last, position in enumerate(hits):
+        in_window[text[position:position + 2]] += 1
+        while position - hits[first] >= width:
+            gram = text[hits[first]:hits[first] + 2]
+            in_window[gram] -= 1
+            if not in_window[gram]:
+                del in_window[gram]
+            first += 1
+        if len(in_window) > best[2]:
+            best = (first, last, len(in_window))
+    return hits[best[0]], min(hits[best[1]] + 1, len(text) - 1), best[2]
+
+class LyricsIndex:
+    """Character-bigram inverted index over assembled verses. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._unigrams: Dict[str, Set[str]] = defaultdict(set)
+        self._verses: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._verses)
+
+    def add(self, verse_id: str, text: str, measures: List[int], metadata: Dict[str, Any]):
+        normalized, positions = normalize(text)
+        with self._lock:
+            self._remove_locked(verse_id)
+            self._verses[verse_id] = {**metadata, "text": text, "measures": measures,
+                                      "normalized": normalized, "positions": positions}
+            for gram in _bigrams(normalized):
+                self._postings[gram].add(verse_id)
+            for char in set(normalized):
+                self._unigrams[char].add(verse_id)
+
+    def remove(self, verse_id: str):
+        with self._lock:
+            self._remove_locked(verse_id)
+
+    def _remove_locked(self, verse_id: str):
+        verse = self._verses.pop(verse_id, None)
+        if verse is None:
+            return
+        for postings, grams in ((self._postings, _bigrams(verse["normalized"])), (self._unigrams, set(verse["normalized"]))):
+            for gram in grams:
+                postings[gram].discard(verse_id)
+                if not postings[gram]:
+                    del postings[gram]
+
+    def _hit(self, verse: Dict[str, Any], start: int, end: int, exact: bool) -> Dict[str, Any]:
+        """Result dict for normalized characters start..end (inclusive) of a verse."""
+        first, last = verse["positions"][start], verse["positions"][end]
+        return {
+            "source_path": verse["source_path"],
+            "file_name": verse["file_name"],
+            "title": verse["title"],
+            "instrument": verse["instrument"],
+            "verse": verse["verse"],
+            "measure_start": verse["measures"][first],
+            "measure_end": verse["measures"][last],
+            "text": verse["text"][first:last + 1],
+            "exact": exact,
+        }
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Verses containing the query, exact matches first; one hit per score and verse."""
+        normalized, _ = normalize(query)
+        if not normalized:
+            return []
+        grams = _bigrams(normalized)
+        with self._lock:
+            postings = [self._postings.get(gram, set()) if len(normalized) > 1 else self._unigrams.get(normalized, set())
+                        for gram in grams]
+            candidates = set.intersection(*sorted(postings, key=len)) if postings else set()
+            results = []
+            for verse_id in sorted(candidates):
+                verse = self._verses[verse_id]
+                start = verse["normalized"].find(normalized)
+                if start >= 0:
+                    results.append(self._hit(verse, start, start + len(normalized) - 1, True))
+                    if len(results) >= limit:
+                        return results
+            if results or len(grams) < 2:
+                return results
+
+            # No exact match: rank verses by the share of query bigrams found close
+            # together, in a window about as long as the query. Counted over the
+            # whole verse, bigrams scattered through a long verse would match too.
+            overlap: Dict[str, int] = defaultdict(int)
+            for gram_postings in postings:
+                for verse_id in gram_postings:
+                    overlap[verse_id] += 1
+            width = len(normalized) * 3 // 2
+            ranked = []
+            for verse_id, count in overlap.items():
+                # The verse-wide count bounds the window's, so most verses are skipped cheaply
+                if count / len(grams) < FUZZY_MIN_OVERLAP:
+                    continue
+                start, end, found = _densest_span(self._verses[verse_id]["normalized"], grams, width)
+                if found / len(grams) >= FUZZY_MIN_OVERLAP:
+                    ranked.append((found, verse_id, start, end))
+            ranked.sort(key=lambda item: (-item[0], item[1]))
+            for _, verse_id, start, end in ranked[:limit]:
+                results.append(self._hit(self._verses[verse_id], start, end, False))
+        return results
+
+class LyricsStore:
+    """SQLite persistence of assembled verses. Thread-safe."""
+
+    def __init__(self, path: str = STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verses ("
+            " id TEXT PRIMARY KEY, source_path TEXT NOT NULL, file_name TEXT, title TEXT,"
+            " instrument TEXT, verse TEXT, text TEXT NOT NULL, measures TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verses_source ON verses (source_path)")
+        self._conn.commit()
+
+    def replace_source(self, source_path: str, rows: List[Tuple[str, str, str, str, str, str, List[int]]]) -> List[str]:
+        """Replace a file's verses with rows of (id, file_name, title, instrument, verse, text, measures).
+
+        Returns the ids that were stored before.
+        """
+        with self._lock:
+            old_ids = [row[0] for row in self._conn.execute("SELECT id FROM verses WHERE source_path = ?", (source_path,))]
+            self._conn.execute("DELETE FROM verses WHERE source_path = ?", (source_path,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO verses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row_id, source_path, file_name, title, instrument, verse, text, json.dumps(measures))
+                 for row_id, file_name, title, instrument, verse, text, measures in rows],
+            )
+            self._conn.commit()
+        return old_ids
+
+    def iter_verses(self) -> Iterable[Tuple[str, str, str, str, str, str, str, List[int]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source_path, file_name, title, instrument, verse, text, measures FROM verses"
+            ).fetchall()
+        return iter([(*row[:7], json.loads(row[7])) for row in rows])
+
+_store: Optional[LyricsStore] = None
+_index: Optional[LyricsIndex] = None
+_lock = threading.Lock()
+
+def get_lyrics_store() -> LyricsStore:
+    """Process-wide lyrics store, created on first use."""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = LyricsStore()
+        return _store
+
+def _metadata(source_path: str, file_name: str, title: str, instrument: str, verse: str) -> Dict[str, Any]:
+    return {"source_path": source_path, "file_name": file_name, "title": title,
+            "instrument": instrument, "verse": verse}
+
+def get_lyrics_index() -> LyricsIndex:
+    """Process-wide lyrics index, built from the lyrics store on first use."""
+    global _index
+    store = get_lyrics_store()
+    with _lock:
+        if _index is None:
+            index = LyricsIndex()
+            for row_id, source_path, file_name, title, instrument, verse, text, measures in store.iter_verses():
+                index.add(row_id, text, measures, _metadata(source_path, file_name, title, instrument, verse))
+            _index = index
+        return _index
+
+def update_lyrics_index(source_path: str, lyrics_docs: List[Any]):
+    """Replace a file's verses (Documents from MusicXMLReader.build_lyrics); [] removes them."""
+    rows = [
+        (f"{source_path}|{doc.id_}", doc.metadata["file_name"], doc.metadata["title"],
+         doc.metadata["instrument"], doc.metadata["verse"], doc.text, doc.metadata["measures"])
+        for doc in lyrics_docs
+    ]
+    old_ids = get_lyrics_store().replace_source(source_path, rows)
+    with _lock:
+        index = _index
+    if index is None:
+        # Built fresh from the store on first use
+        return
+    for row_id in old_ids:
+        index.remove(row_id)
+    for row_id, file_name, title, instrument, verse, text, measures in rows:
+        index.add(row_id, text, measures, _metadata(source_path, file_name, title, instrument, verse))
+
+def search_lyrics(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Scores and measure ranges whose lyrics contain the query text."""
+    return get_lyrics_index().search(query, limit=limit)
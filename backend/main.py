@@ -1,13 +1,18 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-import shutil
 import os
+import json
+import time
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
-from converter import convert_musicxml_to_abc
-from agent import create_clef_agent
-from rag_indexer import get_index, add_document_to_index
+from melody_index import search_melody
+from melodic_similarity import similar_scores
+from lyrics_index import search_lyrics
+from worker_pool import get_chat_pool, PoolBusyError
+from jobs import get_job_queue
 
 # Load environment variables (override existing ones)
 load_dotenv(override=True)
@@ -25,11 +30,66 @@ app.add_middleware(
 
 UPLOAD_DIR = "data/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_CHUNK_BYTES = 1 << 20
 
-# Initialize Agent and Index
-# We initialize the index here to ensure it's ready
-rag_index = get_index(data_dir="data/Catholic", persist_dir="data/chromadb")
-agent_executor = create_clef_agent()
+# Seconds clients are told to wait before retrying while the index warms up
+RETRY_AFTER_SECONDS = int(os.environ.get("CLEF_RETRY_AFTER", "5"))
+
+# Built by the warmup thread; LlamaIndex, Chroma and music21 are imported
+# there too, so uvicorn accepts connections right away
+agent_executor = None
+_ready = threading.Event()
+_startup = {"stage": "starting", "error": None, "started_at": time.time(),
+            "ready_at": None, "index_loaded": False, "lexical_loaded": False, "model_warm": False,
+            "documents": 0}
+
+def _warm_up():
+    """Load or build the index and BM25 index, warm the embedding model and create the agent."""
+    global agent_executor
+    try:
+        _startup["stage"] = "loading index"
+        from index_registry import sync_corpora, corpus_status
+        from agent import create_clef_agent, get_rag_engine
+        from llama_index.core import Settings
+        # One index, shared with the agent, with every corpus in CLEF_CORPORA synced
+        index = sync_corpora()
+        _startup["index_loaded"] = True
+        _startup["corpora"] = corpus_status()
+        _startup["documents"] = index.vector_store.client.count()
+
+        # BM25 is built from the measure store on first use; after the sync so it sees every corpus
+        _startup["stage"] = "building lexical index"
+        from lexical_index import get_lexical_index
+        get_lexical_index()
+        _startup["lexical_loaded"] = True
+
+        _startup["stage"] = "warming embedding model"
+        Settings.embed_model.get_query_embedding("warm up")
+        _startup["model_warm"] = True
+
+        _startup["stage"] = "creating agent"
+        agent_executor = create_clef_agent()
+        get_rag_engine()
+
+        _startup["stage"] = "ready"
+        _startup["ready_at"] = time.time()
+        _ready.set()
+        print(f"Ready after {_startup['ready_at'] - _startup['started_at']:.1f} s "
+              f"({_startup['documents']} chunks indexed)")
+    except Exception as e:
+        _startup["stage"] = "failed"
+        _startup["error"] = str(e)
+        print(f"Startup failed: {e}")
+
+@app.on_event("startup")
+def start_warmup():
+    threading.Thread(target=_warm_up, name="warmup", daemon=True).start()
+
+def _require_ready():
+    """Fail fast with 503 + Retry-After until warmup has finished."""
+    if not _ready.is_set():
+        detail = f"Service is starting ({_startup['stage']})" if not _startup["error"] else f"Startup failed: {_startup['error']}"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
 
 class ChatRequest(BaseModel):
     message: str
@@ -38,26 +98,37 @@ class ChatRequest(BaseModel):
 async def root():
     return {"message": "Clef.ai Backend is running with LangChain + LlamaIndex"}
 
-@app.post("/upload")
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok", "uptime_s": round(time.time() - _startup["started_at"], 1)}
+
+@app.get("/ready")
+async def ready():
+    """Readiness: index loaded, embedding model warm and agent created."""
+    status = {"ready": _ready.is_set(), **_startup}
+    if not _ready.is_set():
+        return JSONResponse(status_code=503, content=status, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return status
+
+@app.post("/upload", status_code=202)
 async def upload_file(file: UploadFile = File(...)):
+    """Store the file; MusicXML is converted and indexed by a background job (see /jobs/{id})."""
     try:
         file_path = os.path.join(UPLOAD_DIR, file.filename)
         with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                buffer.write(chunk)
             
         # Process file if it's MusicXML
         if file.filename.endswith(".xml") or file.filename.endswith(".mxl"):
-            # Convert to ABC (Optional now, but good for display/legacy)
-            abc_content = convert_musicxml_to_abc(file_path)
-            
-            # Add to RAG Index using Custom Reader
-            if rag_index:
-                add_document_to_index(Path(file_path), rag_index)
-            
+            # ABC conversion and indexing run on the upload workers; jobs
+            # submitted during startup wait for the index there
+            job_id = get_job_queue().submit(Path(file_path))
             return {
                 "filename": file.filename,
-                "message": "File uploaded, converted, and indexed successfully",
-                "abc_content": abc_content[:200] + "..." if abc_content else "Conversion failed"
+                "job_id": job_id,
+                "message": "File uploaded; conversion and indexing are running in the background",
             }
             
         return {"filename": file.filename, "message": "File uploaded successfully"}
@@ -65,21 +136,90 @@ async def upload_file(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Stage (queued, converting, indexing, done, failed), measures indexed so far, and the result."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id!r}")
+    return job
+
 @app.post("/chat")
 async def chat(request: ChatRequest):
+    _require_ready()
     try:
-        # Use LangChain Agent
-        response = agent_executor.invoke({"input": request.message})
+        # Use LangChain Agent, on a worker thread so the event loop keeps serving
+        response, timings = await get_chat_pool().run(agent_executor.invoke, {"input": request.message})
+        print(f"Chat answered (queued {timings['queue_ms']:.0f} ms, ran {timings['run_ms']:.0f} ms)")
         
         return {
             "response": response["output"],
             "source": "LangChain Agent",
+            "timings": timings,
             # "steps": response["intermediate_steps"] # Optional: return steps if needed
         }
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
     except Exception as e:
         print(f"Error in chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """/chat as server-sent events: a "sources" event with the retrieved chunks,
+    then "token" events as the answer is synthesized, then "done"."""
+    _require_ready()
+    pool = get_chat_pool()
+    try:
+        pool.check_capacity()
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+    async def events():
+        queue_ms = 0.0
+        async for event in pool.stream(agent_executor.stream, {"input": request.message}):
+            if "type" not in event:
+                # Leading timings from the pool
+                queue_ms = event["queue_ms"]
+                continue
+            if event["type"] == "done":
+                event["timings"] = {"queue_ms": queue_ms}
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    # no-cache / no buffering so proxies pass tokens through as they come
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/chat/stats")
+async def chat_stats():
+    """Worker pool load and queueing times of /chat requests."""
+    return get_chat_pool().stats()
+
+@app.get("/melody")
+def melody(q: str, limit: int = 5):
+    """Scores containing a melody fragment (note names or ABC), with matched measures.
+
+    The index lookups below are synchronous, so these handlers are plain
+    functions and FastAPI runs them on its thread pool instead of the event loop.
+    """
+    try:
+        return {"query": q, "results": search_melody(q, limit=limit)}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/lyrics")
+def lyrics(q: str, limit: int = 10):
+    """Scores, verses and measure ranges whose lyrics contain the query text."""
+    return {"query": q, "results": search_lyrics(q, limit=limit)}
+
+@app.get("/similar")
+def similar(score: str, limit: int = 5):
+    """Hymns with the most similar melodies, from the precomputed neighbour table."""
+    results = similar_scores(score, limit=limit)
+    if results is None:
+        raise HTTPException(status_code=404, detail=f"Unknown score {score!r}")
+    return {"score": score, "results": results}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,159 @@
+"""
+Exact (score, part, measure) lookup store.
+
+Questions like "what notes are in measure 5 of der-leiermann?" are key lookups,
+not similarity searches. Every chunk written to the vector index is mirrored
+into a SQLite table keyed by its chunk id and indexed by score, part and
+measure range, so those questions are answered without touching the
+embedding model or Chroma.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.environ.get("CLEF_MEASURE_STORE", os.path.join(BACKEND_DIR, "data", "chromadb", "measures.sqlite3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    file_name TEXT COLLATE NOCASE,
+    file_stem TEXT COLLATE NOCASE,
+    title TEXT COLLATE NOCASE,
+    instrument TEXT COLLATE NOCASE,
+    measure_start INTEGER,
+    measure_end INTEGER,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_path);
+CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_name, instrument, measure_start);
+CREATE INDEX IF NOT EXISTS chunks_stem ON chunks (file_stem, instrument, measure_start);
+CREATE INDEX IF NOT EXISTS chunks_title ON chunks (title, instrument, measure_start);
+"""
+
+class MeasureStore:
+    """SQLite mirror of indexed chunks for exact lookups. Thread-safe."""
+
+    def __init__(self, path: str = STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def upsert(self, docs: Iterable[Any]):
+        """Insert or replace chunks (LlamaIndex Documents with chunk metadata)."""
+        rows = []
+        for doc in docs:
+            metadata = doc.metadata
+            file_name = metadata.get("file_name", "")
+            rows.append((
+                doc.id_,
+                metadata.get("source_path", ""),
+                file_name,
+                Path(file_name).stem,
+                metadata.get("title"),
+                metadata.get("instrument"),
+                metadata.get("measure_start"),
+                metadata.get("measure_end"),
+                doc.text,
+                json.dumps(metadata, ensure_ascii=False),
+            ))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def delete_ids(self, ids: List[str]):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def delete_source(self, source_path: str) -> List[str]:
+        """Delete every chunk of a file, returning the deleted ids."""
+        with self._lock:
+            ids = [row[0] for row in self._conn.execute("SELECT id FROM chunks WHERE source_path = ?", (source_path,))]
+            self._conn.execute("DELETE FROM chunks WHERE source_path = ?", (source_path,))
+            self._conn.commit()
+        return ids
+
+    def lookup(self, score: str, part: Optional[str] = None, measure: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Chunks of a score, optionally narrowed to a part and/or a measure.
+
+        score matches the file name, the file name without extension or the
+        title, case-insensitively. Returns dicts with id, text and metadata
+        ordered by part and measure.
+        """
+        where = ["(file_name = ? OR file_stem = ? OR title = ?)"]
+        params: List[Any] = [score, score, score]
+        if part:
+            # Vertical chunks hold every part
+            where.append("(instrument = ? OR instrument = 'All Parts')")
+            params.append(part)
+        if measure is not None:
+            where.append("measure_start <= ? AND measure_end >= ?")
+            params += [measure, measure]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, text, metadata FROM chunks WHERE {' AND '.join(where)} "
+                "ORDER BY instrument, measure_start",
+                params,
+            ).fetchall()
+        return [{"id": row[0], "text": row[1], "metadata": json.loads(row[2])} for row in rows]
+
+    def get(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Chunks by id, as dicts with id, text and metadata."""
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for row in rows:
+                    found[row[0]] = {"id": row[0], "text": row[1], "metadata": json.loads(row[2])}
+        return found
+
+    def matching_ids(self, where: str, params: List[Any]) -> Set[str]:
+        """Ids of chunks matching an SQL condition over the chunks table columns."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id FROM chunks WHERE {where}", params).fetchall()
+        return {row[0] for row in rows}
+
+    def names(self) -> Tuple[List[Tuple[str, str, str]], List[str]]:
+        """Distinct (file name, file stem, title) of the stored scores, and distinct part names."""
+        with self._lock:
+            scores = self._conn.execute("SELECT DISTINCT file_name, file_stem, title FROM chunks").fetchall()
+            parts = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT instrument FROM chunks WHERE instrument IS NOT NULL AND instrument != 'All Parts'"
+            )]
+        return scores, parts
+
+    def iter_texts(self) -> Iterator[Tuple[str, str]]:
+        """(id, text) of every chunk, for building secondary indexes."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, text FROM chunks").fetchall()
+        return iter(rows)
+
+_store: Optional[MeasureStore] = None
+_store_lock = threading.Lock()
+
+def get_measure_store() -> MeasureStore:
+    """Process-wide measure store, created on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MeasureStore()
+        return _store
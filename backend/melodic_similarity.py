@@ -0,0 +1,231 @@
+"""
+Whole-score melodic similarity ("which other hymns sound like this one?").
+
+Each score's melody (the highest note of each onset in its first part, see
+MusicXMLReader.build_melodies and encode_melody) is summarised at index time
+as a fixed-size NumPy feature vector: pitch-class histogram (rotated so the
+most used pitch class comes first, making it key-independent), interval
+distribution, contour, and rhythm profile. The k
+nearest neighbours of every score are precomputed and kept in SQLite, so a
+similarity question is a table lookup; uploads and deletions update only
+the rows they affect.
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from melody_index import decode_melody
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.environ.get("CLEF_SIMILARITY_STORE", os.path.join(BACKEND_DIR, "data", "chromadb", "similarity.sqlite3"))
+# Neighbours kept per score
+SIMILAR_K = int(os.environ.get("CLEF_SIMILAR_K", "10"))
+CONTOUR_POINTS = 16
+FEATURE_DIM = 12 + 25 + 3 + CONTOUR_POINTS + 8
+
+def _unit(block: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(block)
+    return block / norm if norm else block
+
+def melodic_features(melody: str) -> Optional[np.ndarray]:
+    """Feature vector (length FEATURE_DIM, unit norm) of an encoded melody, or None if too short."""
+    pitches, durations, _ = decode_melody(melody)
+    if len(pitches) < 2:
+        return None
+    pitches = np.asarray(pitches, dtype=np.int64)
+    durations = np.asarray(durations, dtype=np.float64)
+    steps = np.diff(pitches)
+
+    pitch_classes = np.bincount(pitches % 12, weights=durations, minlength=12)
+    pitch_classes = np.roll(pitch_classes, -int(np.argmax(pitch_classes)))
+    intervals = np.bincount(np.clip(steps, -12, 12) + 12, minlength=25).astype(np.float64)
+    directions = np.array([np.mean(steps < 0), np.mean(steps == 0), np.mean(steps > 0)])
+
+    # Pitch relative to the mean, sampled at evenly spaced points in time
+    onsets = np.concatenate(([0.0], np.cumsum(durations)[:-1]))
+    grid = np.linspace(0.0, durations.sum(), CONTOUR_POINTS, endpoint=False)
+    curve = (pitches[np.searchsorted(onsets, grid, side="right") - 1] - pitches.mean()) / 12.0
+
+    # Time spent on each note value, from 16ths (bin 0) to breves (bin 7)
+    values = np.clip(np.round(np.log2(durations)).astype(np.int64) + 4, 0, 7)
+    rhythm = np.bincount(values, weights=durations, minlength=8)
+
+    # Each block gets equal weight in the cosine similarity
+    blocks = [pitch_classes, intervals, directions, curve, rhythm]
+    return _unit(np.concatenate([_unit(block) for block in blocks])).astype(np.float32)
+
+class SimilarityTable:
+    """Feature vectors plus precomputed k-nearest-neighbour lists, persisted in SQLite. Thread-safe."""
+
+    def __init__(self, path: str = STORE_PATH, k: int = SIMILAR_K):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.k = k
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " source_path TEXT PRIMARY KEY, file_name TEXT, title TEXT, vector BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS neighbors ("
+            " source_path TEXT NOT NULL, rank INTEGER NOT NULL, neighbor TEXT NOT NULL, similarity REAL NOT NULL,"
+            " PRIMARY KEY (source_path, rank));"
+        )
+        self._conn.commit()
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._matrix = np.zeros((0, FEATURE_DIM), dtype=np.float32)
+        self._neighbors: Dict[str, List[Tuple[str, float]]] = {}
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _load(self):
+        vectors = []
+        for source_path, file_name, title, blob in self._conn.execute("SELECT * FROM scores"):
+            vector = np.frombuffer(blob, dtype=np.float32)
+            if vector.shape[0] != FEATURE_DIM:
+                # Written by an older feature layout; re-indexing replaces it
+                continue
+            self._rows[source_path] = len(self._ids)
+            self._ids.append(source_path)
+            self._meta[source_path] = (file_name, title)
+            vectors.append(vector)
+        if vectors:
+            self._matrix = np.stack(vectors)
+        for source_path, _, neighbor, similarity in self._conn.execute(
+            "SELECT * FROM neighbors ORDER BY source_path, rank"
+        ):
+            if source_path in self._rows and neighbor in self._rows:
+                self._neighbors.setdefault(source_path, []).append((neighbor, similarity))
+        missing = [source_path for source_path in self._ids if source_path not in self._neighbors]
+        if missing:
+            self._recompute_locked(missing)
+
+    def _top_k(self, row: int) -> List[Tuple[str, float]]:
+        similarities = self._matrix @ self._matrix[row]
+        similarities[row] = -np.inf
+        count = min(self.k, len(self._ids) - 1)
+        if count <= 0:
+            return []
+        best = np.argpartition(-similarities, count - 1)[:count]
+        best = best[np.argsort(-similarities[best])]
+        return [(self._ids[i], float(similarities[i])) for i in best]
+
+    def _recompute_locked(self, source_paths: List[str]):
+        for source_path in source_paths:
+            self._neighbors[source_path] = self._top_k(self._rows[source_path])
+        self._persist_locked(source_paths)
+
+    def _persist_locked(self, source_paths: List[str]):
+        self._conn.executemany("DELETE FROM neighbors WHERE source_path = ?", [(p,) for p in source_paths])
+        self._conn.executemany(
+            "INSERT INTO neighbors VALUES (?, ?, ?, ?)",
+            [(source_path, rank, neighbor, similarity)
+             for source_path in source_paths
+             for rank, (neighbor, similarity) in enumerate(self._neighbors.get(source_path, []))],
+        )
+        self._conn.commit()
+
+    def upsert(self, source_path: str, file_name: str, title: str, vector: np.ndarray):
+        """Add or replace a score and update the neighbour lists it affects."""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if source_path in self._rows:
+                self._matrix[self._rows[source_path]] = vector
+            else:
+                self._rows[source_path] = len(self._ids)
+                self._ids.append(source_path)
+                self._matrix = np.vstack([self._matrix, vector[None, :]])
+            self._meta[source_path] = (file_name, title)
+            self._conn.execute("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                               (source_path, file_name, title, vector.tobytes()))
+
+            row = self._rows[source_path]
+            similarities = self._matrix @ vector
+            changed = [source_path]
+            recompute = []
+            for other, other_row in self._rows.items():
+                if other == source_path:
+                    continue
+                neighbors = self._neighbors.get(other, [])
+                if any(neighbor == source_path for neighbor, _ in neighbors):
+                    # Its similarity to this score may have dropped below the others
+                    recompute.append(other)
+                elif len(neighbors) < self.k or similarities[other_row] > neighbors[-1][1]:
+                    neighbors = sorted(neighbors + [(source_path, float(similarities[other_row]))],
+                                       key=lambda item: item[1], reverse=True)[:self.k]
+                    self._neighbors[other] = neighbors
+                    changed.append(other)
+            self._neighbors[source_path] = self._top_k(row)
+            self._persist_locked(changed)
+            self._recompute_locked(recompute)
+
+    def remove(self, source_path: str):
+        """Drop a score; neighbour lists that contained it are recomputed."""
+        with self._lock:
+            row = self._rows.pop(source_path, None)
+            if row is None:
+                return
+            self._ids.pop(row)
+            self._matrix = np.delete(self._matrix, row, axis=0)
+            self._rows = {other: i for i, other in enumerate(self._ids)}
+            self._meta.pop(source_path, None)
+            self._neighbors.pop(source_path, None)
+            self._conn.execute("DELETE FROM scores WHERE source_path = ?", (source_path,))
+            self._conn.execute("DELETE FROM neighbors WHERE source_path = ?", (source_path,))
+            affected = [other for other, neighbors in self._neighbors.items()
+                        if any(neighbor == source_path for neighbor, _ in neighbors)]
+            self._recompute_locked(affected)
+
+    def resolve(self, score: str) -> Optional[str]:
+        """Source path of a score given its file name, file name without extension or title."""
+        wanted = score.casefold()
+        with self._lock:
+            for source_path, (file_name, title) in self._meta.items():
+                if wanted in ((file_name or "").casefold(), Path(file_name or "").stem.casefold(), (title or "").casefold()):
+                    return source_path
+        return None
+
+    def similar(self, source_path: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Precomputed nearest neighbours of a score, most similar first."""
+        with self._lock:
+            return [
+                {"source_path": neighbor, "file_name": self._meta[neighbor][0],
+                 "title": self._meta[neighbor][1], "similarity": similarity}
+                for neighbor, similarity in self._neighbors.get(source_path, [])[:limit]
+            ]
+
+_table: Optional[SimilarityTable] = None
+_table_lock = threading.Lock()
+
+def get_similarity_table() -> SimilarityTable:
+    """Process-wide similarity table, loaded on first use."""
+    global _table
+    with _table_lock:
+        if _table is None:
+            _table = SimilarityTable()
+        return _table
+
+def update_melodic_similarity(source_path: str, melody_docs: List[Any]):
+    """Refresh a score's features and neighbours from its melody Documents; [] removes it."""
+    table = get_similarity_table()
+    vector = melodic_features(melody_docs[0].text) if melody_docs else None
+    if vector is None:
+        table.remove(source_path)
+        return
+    metadata = melody_docs[0].metadata
+    table.upsert(source_path, metadata["file_name"], metadata["title"], vector)
+
+def similar_scores(score: str, limit: int = 5) -> Optional[List[Dict[str, Any]]]:
+    """Hymns that sound most like the given one, or None if the score is unknown."""
+    table = get_similarity_table()
+    source_path = table.resolve(score)
+    if source_path is None:
+        return None
+    return table.similar(source_path, limit)
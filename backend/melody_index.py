@@ -0,0 +1,375 @@
+"""
+Transposition-invariant melody fragment search.
+
+Users hum or type a melody ("E D C D E E E") and want to know which hymn it
+comes from. Dense embeddings of measure text cannot answer that, so every
+part's melody (highest note of each onset) is reduced at ingestion time to
+pitch intervals and duration ratios, and n-grams of those go into an
+in-memory inverted index. Intervals do not change under transposition, so a
+fragment typed in any key matches.
+
+Melodies are persisted in SQLite next to the measure store; the inverted
+index is rebuilt from it on first use and kept current by ingestion.
+"""
+
+import os
+import re
+import math
+import sqlite3
+import threading
+from array import array
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.environ.get("CLEF_MELODY_STORE", os.path.join(BACKEND_DIR, "data", "chromadb", "melodies.sqlite3"))
+# Intervals per n-gram; fragments need at least NGRAM + 1 notes
+NGRAM = int(os.environ.get("CLEF_MELODY_NGRAM", "3"))
+# Weight of an n-gram whose rhythm matches too, relative to an interval-only match
+RHYTHM_WEIGHT = 0.5
+
+DURATION_QL = {
+    "longa": 16.0, "breve": 8.0, "whole": 4.0, "half": 2.0, "quarter": 1.0,
+    "eighth": 0.5, "16th": 0.25, "32nd": 0.125, "64th": 0.0625,
+}
+_STEPS = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+_ALTERS = {"#": 1, "##": 2, "-": -1, "--": -2, "b": -1, "bb": -2}
+_PITCH_RE = re.compile(r"([A-G])(##|#|--|-|bb|b)?(-?\d)?")
+_NOTE_RUN_RE = re.compile(r"(?<![\w#-])[A-G](?:##|#|bb|b)?\d?(?:[\s,]+[A-G](?:##|#|bb|b)?\d?(?![\w#-])){3,}")
+
+# ABC notation
+_ABC_NOTE_RE = re.compile(r"([_^=]*)([A-Ga-g])([,']*)(\d*)(/*)(\d*)")
+_MAJOR_KEYS = ["Cb", "Gb", "Db", "Ab", "Eb", "Bb", "F", "C", "G", "D", "A", "E", "B", "F#", "C#"]
+_MINOR_KEYS = ["Ab", "Eb", "Bb", "F", "C", "G", "D", "A", "E", "B", "F#", "C#", "G#", "D#", "A#"]
+
+def pitch_to_midi(name: str) -> Optional[int]:
+    """MIDI number of a pitch name such as "C#4", "B-3" or "Eb5"."""
+    match = _PITCH_RE.fullmatch(name)
+    if not match or match.group(3) is None:
+        return None
+    step, alter, octave = match.groups()
+    return 12 * (int(octave) + 1) + _STEPS[step] + _ALTERS.get(alter or "", 0)
+
+def encode_melody(measures: List[Dict[str, Any]]) -> str:
+    """Melody line of a part as "measure:midi:quarterLength" tokens.
+
+    Notes are grouped by their offset in the measure, so voices sharing a
+    staff are not read one after the other: each onset contributes its
+    highest note, and onsets under a higher note still sounding are dropped.
+    Grace notes are skipped.
+    """
+    tokens = []
+    for measure in measures:
+        onsets: Dict[float, Tuple[int, float]] = {}
+        for note in measure["notes"]:
+            ql = DURATION_QL.get(note["type"])
+            pitches = [midi for midi in map(pitch_to_midi, note["pitches"]) if midi is not None]
+            if ql and pitches and (note["offset"] not in onsets or max(pitches) > onsets[note["offset"]][0]):
+                onsets[note["offset"]] = (max(pitches), ql)
+        held_until, held_pitch = None, None
+        for offset in sorted(onsets):
+            midi, ql = onsets[offset]
+            if held_until is not None and offset < held_until and midi < held_pitch:
+                continue
+            held_until, held_pitch = offset + ql, midi
+            tokens.append(f"{measure['number']}:{midi}:{ql:g}")
+    return " ".join(tokens)
+
+def decode_melody(text: str) -> Tuple[List[int], List[float], List[int]]:
+    """(pitches, quarter lengths, measure numbers) of an encoded melody."""
+    pitches, durations, measures = [], [], []
+    for token in text.split():
+        measure, midi, ql = token.split(":")
+        measures.append(int(measure))
+        pitches.append(int(midi))
+        durations.append(float(ql))
+    return pitches, durations, measures
+
+def _key_accidentals(key: str) -> Dict[str, int]:
+    """Accidentals implied by an ABC K: field, e.g. "G" -> {"F": 1}."""
+    match = re.match(r"([A-G][#b]?)\s*(m(?:in)?)?(?![a-z])", key.strip())
+    if not match:
+        return {}
+    names = _MINOR_KEYS if match.group(2) else _MAJOR_KEYS
+    if match.group(1) not in names:
+        return {}
+    fifths = names.index(match.group(1)) - 7
+    if fifths >= 0:
+        return {step: 1 for step in "FCGDAEB"[:fifths]}
+    return {step: -1 for step in "BEADGCF"[:-fifths]}
+
+def _parse_abc(abc: str) -> Tuple[List[int], List[float]]:
+    key_accidentals: Dict[str, int] = {}
+    pitches, durations = [], []
+    for line in abc.splitlines():
+        header = re.match(r"\s*([A-Za-z]):(.*)", line)
+        if header:
+            if header.group(1) == "K":
+                key_accidentals = _key_accidentals(header.group(2))
+            continue
+        # Chord symbols and decorations are not notes
+        line = re.sub(r'"[^"]*"|![^!]*!', " ", line)
+        for bar in line.split("|"):
+            bar_accidentals: Dict[Tuple[str, int], int] = {}
+            for accidental, letter, octave_marks, num, slashes, den in _ABC_NOTE_RE.findall(bar):
+                step = letter.upper()
+                octave = 4 + letter.islower() + octave_marks.count("'") - octave_marks.count(",")
+                if accidental:
+                    alter = accidental.count("^") - accidental.count("_")
+                    bar_accidentals[(step, octave)] = alter
+                else:
+                    alter = bar_accidentals.get((step, octave), key_accidentals.get(step, 0))
+                pitches.append(12 * (octave + 1) + _STEPS[step] + alter)
+                length = int(num) if num else 1
+                if slashes:
+                    length /= int(den) if den else 2 ** len(slashes)
+                durations.append(float(length))
+    return pitches, durations
+
+def parse_fragment(fragment: str) -> Tuple[List[int], Optional[List[float]], bool]:
+    """Pitches (MIDI), durations and whether octaves are known, for a typed
+    note sequence or an ABC snippet.
+
+    Note names without an octave ("E D C D") are placed as close as possible
+    to the previous note and only match by pitch class; typed sequences carry
+    no rhythm, so durations are None.
+    """
+    tokens = [token for token in re.split(r"[\s,]+", fragment.strip()) if token]
+    if tokens and all(_PITCH_RE.fullmatch(token) for token in tokens):
+        pitches: List[int] = []
+        octaves_known = True
+        for token in tokens:
+            step, alter, octave = _PITCH_RE.fullmatch(token).groups()
+            pitch_class = _STEPS[step] + _ALTERS.get(alter or "", 0)
+            if octave is not None:
+                pitches.append(12 * (int(octave) + 1) + pitch_class)
+            elif not pitches:
+                octaves_known = False
+                pitches.append(60 + pitch_class)
+            else:
+                octaves_known = False
+                previous = pitches[-1]
+                pitches.append(min((pitch_class + 12 * k for k in range(12)), key=lambda p: abs(p - previous)))
+        return pitches, None, octaves_known
+    return (*_parse_abc(fragment), True)
+
+def find_melody_fragment(text: str) -> Optional[str]:
+    """A run of four or more note names inside a chat message, if any."""
+    match = _NOTE_RUN_RE.search(text)
+    return match.group() if match else None
+
+def _intervals(pitches: List[int]) -> List[int]:
+    return [b - a for a, b in zip(pitches, pitches[1:])]
+
+def _ratios(durations: List[float]) -> List[int]:
+    # log2 of consecutive duration ratios: 1 = twice as long, -1 = half as long
+    return [max(-3, min(3, round(math.log2(b / a)))) for a, b in zip(durations, durations[1:])]
+
+def _grams(pitches: List[int], durations: Optional[List[float]], n: int):
+    """Yield (position, interval gram, pitch-class interval gram, interval+rhythm gram or None).
+
+    Pitch-class grams fold intervals into -6..5 semitones so that note names
+    typed without octaves still match.
+    """
+    intervals = _intervals(pitches)
+    ratios = _ratios(durations) if durations else None
+    for position in range(len(intervals) - n + 1):
+        interval_gram = tuple(intervals[position:position + n])
+        class_gram = tuple((interval + 6) % 12 - 6 for interval in interval_gram)
+        rhythm_gram = interval_gram + tuple(ratios[position:position + n]) if ratios else None
+        yield position, interval_gram, class_gram, rhythm_gram
+
+class MelodyIndex:
+    """Inverted index of interval and rhythm n-grams over part melodies. Thread-safe.
+
+    Postings are flat unsigned int arrays of (part number, note position) pairs.
+    """
+
+    def __init__(self, n: int = NGRAM):
+        self.n = n
+        self._lock = threading.Lock()
+        self._interval_postings: Dict[tuple, array] = defaultdict(lambda: array("I"))
+        self._class_postings: Dict[tuple, array] = defaultdict(lambda: array("I"))
+        self._rhythm_postings: Dict[tuple, array] = defaultdict(lambda: array("I"))
+        self._parts: Dict[int, Dict[str, Any]] = {}
+        self._part_numbers: Dict[str, int] = {}
+        self._next_part = 0
+
+    def __len__(self) -> int:
+        return len(self._parts)
+
+    def add(self, part_id: str, melody: str, metadata: Dict[str, Any]):
+        pitches, durations, measures = decode_melody(melody)
+        with self._lock:
+            self._remove_locked(part_id)
+            number = self._next_part
+            self._next_part += 1
+            self._part_numbers[part_id] = number
+            grams = list(_grams(pitches, durations, self.n))
+            self._parts[number] = {**metadata, "measures": array("i", measures), "grams": grams}
+            for position, interval_gram, class_gram, rhythm_gram in grams:
+                self._interval_postings[interval_gram].extend((number, position))
+                self._class_postings[class_gram].extend((number, position))
+                if rhythm_gram is not None:
+                    self._rhythm_postings[rhythm_gram].extend((number, position))
+
+    def remove(self, part_id: str):
+        with self._lock:
+            self._remove_locked(part_id)
+
+    def _remove_locked(self, part_id: str):
+        number = self._part_numbers.pop(part_id, None)
+        if number is None:
+            return
+        part = self._parts.pop(number)
+        for postings_by_gram, index in ((self._interval_postings, 1), (self._class_postings, 2), (self._rhythm_postings, 3)):
+            for gram in {grams[index] for grams in part["grams"]}:
+                postings = postings_by_gram.get(gram)
+                if postings is None:
+                    continue
+                kept = array("I")
+                for i in range(0, len(postings), 2):
+                    if postings[i] != number:
+                        kept.extend(postings[i:i + 2])
+                if kept:
+                    postings_by_gram[gram] = kept
+                else:
+                    del postings_by_gram[gram]
+
+    def search(self, pitches: List[int], durations: Optional[List[float]] = None,
+               octaves_known: bool = True, limit: int = 5) -> List[Dict[str, Any]]:
+        """Scores containing the melody, best first.
+
+        Each query n-gram votes for (part, alignment) pairs; the best
+        alignment per score gives its rank and matched measure range.
+        """
+        query_grams = list(_grams(pitches, durations, self.n))
+        if not query_grams:
+            return []
+        interval_votes: Dict[Tuple[int, int], int] = defaultdict(int)
+        rhythm_votes: Dict[Tuple[int, int], int] = defaultdict(int)
+        with self._lock:
+            for query_position, interval_gram, class_gram, rhythm_gram in query_grams:
+                if octaves_known:
+                    postings = self._interval_postings.get(interval_gram, ())
+                else:
+                    postings = self._class_postings.get(class_gram, ())
+                for i in range(0, len(postings), 2):
+                    interval_votes[(postings[i], postings[i + 1] - query_position)] += 1
+                if rhythm_gram is not None:
+                    postings = self._rhythm_postings.get(rhythm_gram, ())
+                    for i in range(0, len(postings), 2):
+                        rhythm_votes[(postings[i], postings[i + 1] - query_position)] += 1
+
+            best: Dict[str, Tuple[float, int, int]] = {}
+            for (number, offset), matched in interval_votes.items():
+                score = matched + RHYTHM_WEIGHT * rhythm_votes.get((number, offset), 0)
+                source = self._parts[number]["source_path"]
+                if source not in best or score > best[source][0]:
+                    best[source] = (score, number, offset)
+
+            results = []
+            for score, number, offset in sorted(best.values(), key=lambda item: item[0], reverse=True)[:limit]:
+                part = self._parts[number]
+                measures = part["measures"]
+                first = max(0, offset)
+                last = min(len(measures) - 1, offset + len(pitches) - 1)
+                results.append({
+                    "source_path": part["source_path"],
+                    "file_name": part["file_name"],
+                    "title": part["title"],
+                    "instrument": part["instrument"],
+                    "score": score,
+                    "matched_ngrams": interval_votes[(number, offset)],
+                    "query_ngrams": len(query_grams),
+                    "measure_start": measures[first],
+                    "measure_end": measures[last],
+                })
+        return results
+
+class MelodyStore:
+    """SQLite persistence of encoded part melodies. Thread-safe."""
+
+    def __init__(self, path: str = STORE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS melodies ("
+            " id TEXT PRIMARY KEY, source_path TEXT NOT NULL, file_name TEXT, title TEXT,"
+            " instrument TEXT, melody TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS melodies_source ON melodies (source_path)")
+        self._conn.commit()
+
+    def replace_source(self, source_path: str, rows: List[Tuple[str, str, str, str, str]]) -> List[str]:
+        """Replace a file's melodies with rows of (id, file_name, title, instrument, melody).
+
+        Returns the ids that were stored before.
+        """
+        with self._lock:
+            old_ids = [row[0] for row in self._conn.execute("SELECT id FROM melodies WHERE source_path = ?", (source_path,))]
+            self._conn.execute("DELETE FROM melodies WHERE source_path = ?", (source_path,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO melodies VALUES (?, ?, ?, ?, ?, ?)",
+                [(row_id, source_path, file_name, title, instrument, melody)
+                 for row_id, file_name, title, instrument, melody in rows],
+            )
+            self._conn.commit()
+        return old_ids
+
+    def iter_melodies(self) -> Iterable[Tuple[str, str, str, str, str, str]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source_path, file_name, title, instrument, melody FROM melodies"
+            ).fetchall()
+        return iter(rows)
+
+_store: Optional[MelodyStore] = None
+_index: Optional[MelodyIndex] = None
+_lock = threading.Lock()
+
+def get_melody_store() -> MelodyStore:
+    """Process-wide melody store, created on first use."""
+    global _store
+    with _lock:
+        if _store is None:
+            _store = MelodyStore()
+        return _store
+
+def get_melody_index() -> MelodyIndex:
+    """Process-wide melody index, built from the melody store on first use."""
+    global _index
+    store = get_melody_store()
+    with _lock:
+        if _index is None:
+            index = MelodyIndex()
+            for row_id, source_path, file_name, title, instrument, melody in store.iter_melodies():
+                index.add(row_id, melody, {"source_path": source_path, "file_name": file_name,
+                                           "title": title, "instrument": instrument})
+            _index = index
+        return _index
+
+def update_melody_index(source_path: str, melody_docs: List[Any]):
+    """Replace a file's melodies (Documents from MusicXMLReader.build_melodies); [] removes them."""
+    rows = [
+        (f"{source_path}|{doc.id_}", doc.metadata["file_name"], doc.metadata["title"],
+         doc.metadata["instrument"], doc.text)
+        for doc in melody_docs
+    ]
+    old_ids = get_melody_store().replace_source(source_path, rows)
+    with _lock:
+        index = _index
+    if index is None:
+        # Built fresh from the store on first use
+        return
+    for row_id in old_ids:
+        index.remove(row_id)
+    for row_id, file_name, title, instrument, melody in rows:
+        index.add(row_id, melody, {"source_path": source_path, "file_name": file_name,
+                                   "title": title, "instrument": instrument})
+
+def search_melody(fragment: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """Find scores containing a note sequence ("E D C D E E E") or ABC snippet."""
+    pitches, durations, octaves_known = parse_fragment(fragment)
+    return get_melody_index().search(pitches, durations, octaves_known, limit=limit)
@@ -1,20 +1,20 @@
-import chromadb
 from chromadb.utils import embedding_functions
 import uuid
+from index_registry import get_collection
 
-# Initialize ChromaDB client
-# Persistent client to save data to disk
-client = chromadb.PersistentClient(path="data/chromadb")
+_collection = None
 
-# Use default embedding function (all-MiniLM-L6-v2)
-# This downloads the model locally.
-embedding_fn = embedding_functions.DefaultEmbeddingFunction()
-
-# Create or get collection
-collection = client.get_or_create_collection(
-    name="sheet_music",
-    embedding_function=embedding_fn
-)
+def get_sheet_music_collection():
+    """The "sheet_music" collection, opened on first use through the shared Chroma client."""
+    global _collection
+    if _collection is None:
+        # Use default embedding function (all-MiniLM-L6-v2)
+        # This downloads the model locally.
+        _collection = get_collection(
+            "sheet_music",
+            embedding_function=embedding_functions.DefaultEmbeddingFunction()
+        )
+    return _collection
 
 def add_to_vector_db(abc_content: str, metadata: dict):
     """
@@ -48,7 +48,7 @@ def add_to_vector_db(abc_content: str, metadata: dict):
         metadatas.append(metadata)
         
     if chunks:
-        collection.add(
+        get_sheet_music_collection().add(
             documents=chunks,
             metadatas=metadatas,
             ids=ids
@@ -66,7 +66,7 @@ def query_rag(query_text: str, n_results: int = 3):
     Returns:
         dict: Query results.
     """
-    results = collection.query(
+    results = get_sheet_music_collection().query(
         query_texts=[query_text],
         n_results=n_results
     )
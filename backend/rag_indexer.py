@@ -1,17 +1,33 @@
 import os
-from typing import List, Dict, Any
+import json
+import signal
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Callable, Optional, Iterable, Iterator, Tuple
 from pathlib import Path
 import music21
-from llama_index.core import VectorStoreIndex, StorageContext
-from llama_index.core.schema import Document
-from llama_index.vector_stores.chroma import ChromaVectorStore
-import chromadb
+import numpy as np
+from llama_index.core.schema import Document, MetadataMode
 from llama_index.core import Settings
+from ingest import run_pipeline
+from fast_reader import extract_score, UnsupportedScoreError
+from embedding_cache import get_embedding_cache
+from measure_store import get_measure_store
+from lexical_index import update_lexical_index
+from answer_cache import invalidate_answer_cache
+from melody_index import encode_melody, update_melody_index
+from melodic_similarity import update_melodic_similarity
+from lyrics_index import assemble_verses, update_lyrics_index
+from index_registry import get_collection, get_vector_index, CHUNK_COLLECTION
+
+# Texts per embedding call and per vector store write
+EMBED_BATCH_SIZE = int(os.environ.get("CLEF_EMBED_BATCH_SIZE", "64"))
 
 # Don't configure at import time - do it lazily when needed
 _settings_configured = False
 
-def _configure_settings():
+def configure_settings():
     """Configure embedding model and LLM based on API key availability."""
     global _settings_configured
     if _settings_configured:
@@ -21,153 +37,909 @@ def _configure_settings():
         print("OPENAI_API_KEY not found. Using local HuggingFace embeddings and mock LLM.")
         from llama_index.embeddings.huggingface import HuggingFaceEmbedding
         from llama_index.core.llms import MockLLM
-        Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
+        Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5", embed_batch_size=EMBED_BATCH_SIZE)
         # Use MockLLM to avoid API calls during indexing
         Settings.llm = MockLLM()
     else:
         print(f"OPENAI_API_KEY found. Using OpenAI embeddings and LLM.")
         from llama_index.embeddings.openai import OpenAIEmbedding
         from llama_index.llms.openai import OpenAI
-        Settings.embed_model = OpenAIEmbedding()
+        Settings.embed_model = OpenAIEmbedding(embed_batch_size=EMBED_BATCH_SIZE)
         Settings.llm = OpenAI(model="gpt-3.5-turbo")
     
     _settings_configured = True
 
+# Bump whenever MusicXMLReader output, or what ingestion derives from it, changes
+# so every file is re-processed (chunks whose content is unchanged are not re-embedded)
+READER_VERSION = "6"
+MANIFEST_NAME = "index_manifest.json"
+READER_BACKENDS = ("music21", "etree")
+READER_BACKEND = os.environ.get("CLEF_READER_BACKEND", "music21")
+CHUNKING_STRATEGIES = ("measure", "window", "vertical")
+CHUNKING = os.environ.get("CLEF_CHUNKING", "measure")
+WINDOW_SIZE = int(os.environ.get("CLEF_WINDOW_SIZE", "4"))
+WINDOW_OVERLAP = int(os.environ.get("CLEF_WINDOW_OVERLAP", "1"))
+ENCODINGS = ("verbose", "compact")
+ENCODING = os.environ.get("CLEF_ENCODING", "verbose")
+# Metadata the compact chunk header already carries; embedding it again only costs tokens
+COMPACT_EXCLUDED_EMBED_KEYS = ["file_name", "instrument", "parts", "measure_number", "measure_start", "measure_end"]
+_DURATION_CODES = {
+    "longa": "00", "breve": "0", "whole": "1", "half": "2", "quarter": "4",
+    "eighth": "8", "16th": "16", "32nd": "32", "64th": "64",
+}
+BACKEND_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+# Score- and part-level summaries, searched first by hierarchical retrieval
+SUMMARY_COLLECTION = "catholic_hymns_summaries"
+
+def embed_model_id() -> str:
+    """Identify the active embedding model so a model switch forces re-embedding."""
+    embed_model = Settings.embed_model
+    model_name = getattr(embed_model, "model_name", None) or type(embed_model).__name__
+    return f"{type(embed_model).__name__}:{model_name}"
+
+def _file_hash(file_path) -> str:
+    """SHA-256 of the file contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_key(file_path: Path) -> str:
+    """Stable manifest key for a file: its path relative to the backend dir."""
+    return Path(os.path.relpath(Path(file_path).resolve(), BACKEND_DIR)).as_posix()
+
+def _load_manifest(manifest_path: Path) -> Dict[str, Any]:
+    if manifest_path.exists():
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {manifest_path}: {e}")
+    return {"files": {}}
+
+def _save_manifest(manifest_path: Path, manifest: Dict[str, Any]):
+    # Write to a temp file first so a crash never leaves a truncated manifest
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def _manifest_entry(file_path: Path, reader_id: str, content_hash: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "content_hash": content_hash or _file_hash(file_path),
+        "mtime": os.path.getmtime(file_path),
+        "reader_version": reader_id,
+        "embed_model": embed_model_id(),
+    }
+
+def _is_current(entry: Optional[Dict[str, Any]], file_path: Path, reader_id: str) -> bool:
+    """True if the manifest entry still describes the file on disk."""
+    if not entry:
+        return False
+    if entry.get("reader_version") != reader_id or entry.get("embed_model") != embed_model_id():
+        return False
+    # mtime match is the cheap path; fall back to hashing when only the mtime moved
+    if entry.get("mtime") == os.path.getmtime(file_path):
+        return True
+    return entry.get("content_hash") == _file_hash(file_path)
+
+def _delete_source_chunks(chroma_collection, source_key: str):
+    """Remove every chunk previously indexed from the given file."""
+    chroma_collection.delete(where={"source_path": source_key})
+
+def get_summary_collection(persist_dir: str = "data/chromadb"):
+    """Chroma collection of score/part summary vectors next to the chunk collection."""
+    return get_collection(SUMMARY_COLLECTION, persist_dir)
+
 # Ensure you have OPENAI_API_KEY set in your environment or .env file
 # For this example, we'll assume it's available or use a placeholder if checking locally without keys.
 
 class MusicXMLReader:
-    """Custom reader for MusicXML files to extract musical data with rich metadata."""
+    """Custom reader for MusicXML files to extract musical data with rich metadata.
 
-    def load_data(self, file_path: Path) -> List[Document]:
-        """Parse MusicXML and return a list of Documents (chunks)."""
-        documents = []
-        try:
-            score = music21.converter.parse(str(file_path))
+    Two extraction backends produce the same Documents (ids, text and
+    metadata; checked on the MusicXML_test fixtures by test_fast_reader.py):
+    "music21" builds the full music21 object model, "etree" streams the XML
+    directly with fast_reader, mirroring music21's ordering and handling of
+    directions, and is much faster and lighter. The default comes from
+    CLEF_READER_BACKEND.
+
+    Chunking strategies (default from CLEF_CHUNKING):
+    - "measure": one Document per (part, measure)
+    - "window": sliding windows of window_size measures per part, overlapping
+      by window_overlap measures
+    - "vertical": all parts of one measure (or of window_size measures) together
+
+    Text encodings (default from CLEF_ENCODING): "verbose" spells notes out
+    ("Notes: C4 (quarter), ..."); "compact" uses run-length ABC-like tokens
+    ("C4/4*2 [C4E4G4]/2") and keeps measure/instrument metadata, which the
+    chunk header already states, out of the embedded text.
+    """
+
+    def __init__(self, backend: Optional[str] = None, chunking: Optional[str] = None,
+                 window_size: Optional[int] = None, window_overlap: Optional[int] = None,
+                 encoding: Optional[str] = None):
+        self.backend = backend or READER_BACKEND
+        if self.backend not in READER_BACKENDS:
+            raise ValueError(f"Unknown reader backend {self.backend!r}; choose from {READER_BACKENDS}")
+        self.chunking = chunking or CHUNKING
+        if self.chunking not in CHUNKING_STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy {self.chunking!r}; choose from {CHUNKING_STRATEGIES}")
+        # Vertical slices cover a single measure unless a window size is given
+        self.window_size = max(1, window_size or (WINDOW_SIZE if self.chunking == "window" else 1))
+        self.window_overlap = WINDOW_OVERLAP if window_overlap is None else window_overlap
+        if self.chunking == "window" and self.window_overlap >= self.window_size:
+            raise ValueError("window_overlap must be smaller than window_size")
+        self.encoding = encoding or ENCODING
+        if self.encoding not in ENCODINGS:
+            raise ValueError(f"Unknown text encoding {self.encoding!r}; choose from {ENCODINGS}")
+
+    @property
+    def config_id(self) -> str:
+        """Identifies reader settings that change the produced Documents."""
+        config = f"{READER_VERSION}/{self.backend}/{self.chunking}"
+        if self.chunking != "measure":
+            config += f"/{self.window_size}-{self.window_overlap}"
+        return f"{config}/{self.encoding}"
+
+    def load_data(self, file_path: Path, derived: bool = False) -> List[Document]:
+        """Parse MusicXML and return a list of Documents (chunks).
+
+        With derived=True the score/part summary Documents, the per-part
+        melody Documents and the per-verse lyrics Documents (see
+        build_summaries, build_melodies, build_lyrics) are appended;
+        split_levels() separates them.
+
+        Parse errors are raised rather than returned as an empty list, so
+        callers never mistake a corrupt file for one without measures and
+        delete its indexed chunks.
+        """
+        if self.backend == "etree":
+            try:
+                score = extract_score(file_path)
+            except UnsupportedScoreError as e:
+                print(f"{e}; falling back to music21 for {file_path.name}")
+                score = self._extract_music21(file_path)
+        else:
+            score = self._extract_music21(file_path)
             
-            # Extract Score Metadata
-            title = score.metadata.title if score.metadata and score.metadata.title else file_path.stem
-            composer = score.metadata.composer if score.metadata and score.metadata.composer else "Unknown"
+        documents = self._build_documents(file_path, score)
+        if derived:
+            documents += self.build_summaries(file_path, score)
+            documents += self.build_melodies(file_path, score)
+            documents += self.build_lyrics(file_path, score)
+        return documents
+
+    def _extract_music21(self, file_path: Path) -> Dict[str, Any]:
+        """Extract the per-measure score dict (see fast_reader) using music21."""
+        # music21 reuses its own pickled parse (scratch directory, keyed by path
+        # and modification time) for files it has parsed before
+        score = music21.converter.parse(str(file_path))
+        
+        # Extract Score Metadata
+        parts = []
+        result = {
+            "title": score.metadata.title if score.metadata and score.metadata.title else None,
+            "composer": score.metadata.composer if score.metadata and score.metadata.composer else None,
+            "key": None,
+            "meter": None,
+            "parts": parts,
+        }
+        
+        # First key and time signature, as fast_reader reports them
+        key_signature = score.recurse().getElementsByClass(music21.key.KeySignature).first()
+        if key_signature is not None:
+            key = key_signature if isinstance(key_signature, music21.key.Key) else key_signature.asKey()
+            result["key"] = key.name
+        time_signature = score.recurse().getElementsByClass(music21.meter.TimeSignature).first()
+        if time_signature is not None:
+            result["meter"] = time_signature.ratioString
+        
+        # Iterate through parts (Instruments)
+        for part in score.parts:
+            measures = []
+            parts.append({"name": part.partName or "Unknown Instrument", "measures": measures})
             
-            # Iterate through parts (Instruments)
-            for part in score.parts:
-                part_name = part.partName if part.partName else "Unknown Instrument"
+            # Iterate through measures
+            for measure in part.getElementsByClass('Measure'):
+                notes = []
+                dynamics = []
                 
-                # Iterate through measures
-                for measure in part.getElementsByClass('Measure'):
-                    measure_number = measure.number
-                    
-                    # Extract content from measure
-                    # We'll create a text representation of the measure's content
-                    # e.g., "Notes: C4 quarter, D4 quarter. Dynamics: mf."
-                    
-                    elements_text = []
-                    notes = []
-                    dynamics = []
-                    lyrics = []
-                    
-                    for element in measure.flatten():
-                        if isinstance(element, music21.note.Note):
-                            notes.append(f"{element.nameWithOctave} ({element.duration.type})")
-                            if element.lyric:
-                                lyrics.append(element.lyric)
-                        elif isinstance(element, music21.chord.Chord):
-                            chord_notes = "-".join([n.nameWithOctave for n in element.notes])
-                            notes.append(f"Chord:{chord_notes} ({element.duration.type})")
-                        elif isinstance(element, music21.dynamics.Dynamic):
-                            dynamics.append(element.value)
-                        elif isinstance(element, music21.expressions.TextExpression):
-                            dynamics.append(element.content)
-                            
-                    content_str = f"Measure {measure_number} of {part_name}.\n"
-                    if notes:
-                        content_str += f"Notes: {', '.join(notes)}.\n"
-                    if dynamics:
-                        content_str += f"Dynamics/Expressions: {', '.join(dynamics)}.\n"
-                    if lyrics:
-                        content_str += f"Lyrics: {' '.join(lyrics)}.\n"
-                        
-                    # Create Document with Metadata
-                    metadata = {
-                        "file_name": file_path.name,
-                        "title": title,
-                        "composer": composer,
-                        "instrument": part_name,
-                        "measure_number": measure_number,
-                        # Add range for easier filtering if needed later, though single measure is fine
-                        "measure_start": measure_number,
-                        "measure_end": measure_number
-                    }
-                    
-                    doc = Document(text=content_str, metadata=metadata)
-                    documents.append(doc)
-                    
-        except Exception as e:
-            print(f"Error parsing {file_path}: {e}")
-            # Return an empty list or a document indicating error? 
-            # For now, skip failed files but log it.
-            pass
-            
+                for element in measure.flatten():
+                    if isinstance(element, music21.note.Note):
+                        notes.append({
+                            "pitches": [element.nameWithOctave],
+                            "type": element.duration.type,
+                            "offset": round(float(element.offset), 4),
+                            "lyric": element.lyric or None,
+                            "lyrics": [
+                                {"verse": str(lyric.number or 1), "syllabic": lyric.syllabic or "single", "text": lyric.text}
+                                for lyric in element.lyrics if lyric.text
+                            ],
+                        })
+                    elif isinstance(element, music21.chord.Chord):
+                        notes.append({
+                            "pitches": [n.nameWithOctave for n in element.notes],
+                            "type": element.duration.type,
+                            "offset": round(float(element.offset), 4),
+                            "lyric": None,
+                            "lyrics": [],
+                        })
+                    elif isinstance(element, music21.dynamics.Dynamic):
+                        dynamics.append(element.value)
+                    elif isinstance(element, music21.expressions.TextExpression):
+                        dynamics.append(element.content)
+                
+                measures.append({"number": measure.number, "notes": notes, "dynamics": dynamics})
+        
+        return result
+
+    def _build_documents(self, file_path: Path, score: Dict[str, Any]) -> List[Document]:
+        """Turn the per-measure score dict into Documents using the chunking strategy."""
+        title = score["title"] or file_path.stem
+        composer = score["composer"] or "Unknown"
+        base_metadata = {"file_name": file_path.name, "title": title, "composer": composer}
+        
+        if self.chunking == "vertical":
+            # Line up parts by measure position and slice all of them together
+            length = max((len(part["measures"]) for part in score["parts"]), default=0)
+            chunks = []
+            for start, end in self._windows(length):
+                chunks.append(("all", [
+                    (part["name"], part["measures"][i])
+                    for i in range(start, end)
+                    for part in score["parts"]
+                    if i < len(part["measures"])
+                ]))
+        else:
+            size = 1 if self.chunking == "measure" else self.window_size
+            chunks = []
+            for part_index, part in enumerate(score["parts"]):
+                measures = part["measures"]
+                for start, end in self._windows(len(measures), size):
+                    chunks.append((part_index, [(part["name"], measure) for measure in measures[start:end]]))
+        
+        documents = []
+        seen_ids = {}
+        for part_key, chunk in chunks:
+            if chunk:
+                text, metadata = self._chunk_content(chunk)
+                # Id unique within the file and stable across edits of the notes;
+                # repeated measure numbers in one part get an ordinal suffix
+                local_id = f"{part_key}/{metadata['measure_start']}-{metadata['measure_end']}"
+                seen_ids[local_id] = seen_ids.get(local_id, 0) + 1
+                if seen_ids[local_id] > 1:
+                    local_id += f"#{seen_ids[local_id]}"
+                doc = Document(id_=local_id, text=text, metadata={**base_metadata, **metadata})
+                if self.encoding == "compact":
+                    doc.excluded_embed_metadata_keys.extend(COMPACT_EXCLUDED_EMBED_KEYS)
+                documents.append(doc)
         return documents
 
-def get_index(data_dir: str = "data/Catholic", persist_dir: str = "data/chromadb"):
-    """Creates or loads the RAG index."""
+    def build_summaries(self, file_path: Path, score: Dict[str, Any]) -> List[Document]:
+        """One score-level and one part-level summary Document per part.
+
+        Summaries carry a "level" metadata key ("score" or "part") and are
+        indexed in their own collection for the first stage of hierarchical
+        retrieval.
+        """
+        title = score["title"] or file_path.stem
+        composer = score["composer"] or "Unknown"
+        key = score.get("key") or "Unknown"
+        meter = score.get("meter") or "Unknown"
+        base_metadata = {"file_name": file_path.name, "title": title, "composer": composer,
+                         "key": key, "meter": meter}
+        header = f"Key: {key}. Meter: {meter}."
+        
+        part_names = list(dict.fromkeys(part["name"] for part in score["parts"]))
+        measure_count = max((len(part["measures"]) for part in score["parts"]), default=0)
+        incipit = next((text for text in map(self._lyrics_incipit, score["parts"]) if text), None)
+        text = f"{title} by {composer}. {header} Parts: {', '.join(part_names)}. {measure_count} measures.\n"
+        if incipit:
+            text += f"Lyrics: {incipit}\n"
+        summaries = [self._summary_document("score", text, {**base_metadata, "level": "score",
+                                                             "measure_count": measure_count})]
+        
+        for part_index, part in enumerate(score["parts"]):
+            text = f"{part['name']} part of {title} by {composer}. {header} {len(part['measures'])} measures.\n"
+            incipit = self._lyrics_incipit(part)
+            if incipit:
+                text += f"Lyrics: {incipit}\n"
+            summaries.append(self._summary_document(f"part/{part_index}", text, {
+                **base_metadata, "level": "part", "instrument": part["name"],
+                "measure_count": len(part["measures"]),
+            }))
+        return summaries
+
+    def build_melodies(self, file_path: Path, score: Dict[str, Any]) -> List[Document]:
+        """One Document per part holding its encoded melody line (see melody_index)."""
+        title = score["title"] or file_path.stem
+        melodies = []
+        for part_index, part in enumerate(score["parts"]):
+            melody = encode_melody(part["measures"])
+            if melody:
+                melodies.append(Document(id_=f"melody/{part_index}", text=melody, metadata={
+                    "file_name": file_path.name, "title": title, "instrument": part["name"], "level": "melody",
+                }))
+        return melodies
+
+    def build_lyrics(self, file_path: Path, score: Dict[str, Any]) -> List[Document]:
+        """One Document per verse with the full assembled lyrics (see lyrics_index).
+
+        Each verse is taken from the part that carries most of its text, so
+        parts repeating the same words (SATB) are indexed once. metadata
+        "measures" holds the measure number of every character.
+        """
+        title = score["title"] or file_path.stem
+        verses: Dict[str, Tuple[str, str, List[int]]] = {}
+        for part in score["parts"]:
+            for verse, (text, measures) in assemble_verses(part["measures"]).items():
+                if verse not in verses or len(text) > len(verses[verse][1]):
+                    verses[verse] = (part["name"], text, measures)
+        return [
+            Document(id_=f"lyrics/{verse}", text=text, metadata={
+                "file_name": file_path.name, "title": title, "instrument": part_name,
+                "verse": verse, "measures": measures, "level": "lyrics",
+            })
+            for verse, (part_name, text, measures) in verses.items()
+        ]
+
+    @staticmethod
+    def _summary_document(local_id: str, text: str, metadata: Dict[str, Any]) -> Document:
+        # The text already states every field, so metadata is not embedded again
+        return Document(id_=local_id, text=text, metadata=metadata,
+                        excluded_embed_metadata_keys=list(metadata))
+
+    @staticmethod
+    def _lyrics_incipit(part: Dict[str, Any], max_chars: int = 60) -> Optional[str]:
+        """Opening words of a part's first verse."""
+        verses = assemble_verses(part["measures"])
+        if not verses:
+            return None
+        text = verses.get("1", next(iter(verses.values())))[0]
+        if len(text) > max_chars:
+            # Cut at a word boundary when there is one
+            text = text[:max_chars].rsplit(" ", 1)[0] if " " in text[:max_chars] else text[:max_chars]
+        return text
+
+    def _windows(self, length: int, size: Optional[int] = None):
+        """Yield (start, end) index ranges of `size` measures overlapping by window_overlap."""
+        size = size or self.window_size
+        step = max(1, size - self.window_overlap) if size > 1 else 1
+        for start in range(0, length, step):
+            end = min(start + size, length)
+            yield start, end
+            if end == length:
+                break
+
+    def _measure_fields(self, measure: Dict[str, Any]) -> List[str]:
+        """Text fields describing one measure, e.g. ["Notes: C4 (quarter)", "Dynamics/Expressions: mf"]."""
+        notes = []
+        lyrics = []
+        for note in measure["notes"]:
+            if len(note["pitches"]) == 1:
+                notes.append(f"{note['pitches'][0]} ({note['type']})")
+                if note["lyric"]:
+                    lyrics.append(note["lyric"])
+            else:
+                notes.append(f"Chord:{'-'.join(note['pitches'])} ({note['type']})")
+        
+        fields = []
+        if notes:
+            fields.append(f"Notes: {', '.join(notes)}")
+        if measure["dynamics"]:
+            fields.append(f"Dynamics/Expressions: {', '.join(measure['dynamics'])}")
+        if lyrics:
+            fields.append(f"Lyrics: {' '.join(lyrics)}")
+        return fields
+
+    def _chunk_content(self, chunk: List[Tuple[str, Dict[str, Any]]]) -> Tuple[str, Dict[str, Any]]:
+        """Text and measure/instrument metadata for a list of (part name, measure) pairs."""
+        numbers = [measure["number"] for _, measure in chunk]
+        part_names = list(dict.fromkeys(name for name, _ in chunk))
+        measure_start, measure_end = min(numbers), max(numbers)
+        vertical = self.chunking == "vertical"
+        instrument = "All Parts" if vertical else part_names[0]
+        metadata = {
+            "instrument": instrument,
+            "measure_number": measure_start,
+            "measure_start": measure_start,
+            "measure_end": measure_end,
+        }
+        if vertical:
+            metadata["parts"] = ", ".join(part_names)
+        
+        if self.encoding == "compact":
+            return self._compact_content(chunk, part_names, measure_start, measure_end), metadata
+        
+        if len(chunk) == 1:
+            # Single measure: "Measure 5 of Soprano.\nNotes: ...\n"
+            part_name, measure = chunk[0]
+            content_str = f"Measure {measure['number']} of {part_name}.\n"
+            for field in self._measure_fields(measure):
+                content_str += f"{field}.\n"
+            return content_str, metadata
+        
+        span = f"Measure {measure_start}" if measure_start == measure_end else f"Measures {measure_start}-{measure_end}"
+        if vertical:
+            content_str = f"{span}, all parts ({', '.join(part_names)}).\n"
+        else:
+            content_str = f"{span} of {instrument}.\n"
+        for part_name, measure in chunk:
+            label = f"{measure['number']} {part_name}" if vertical else f"{measure['number']}"
+            fields = self._measure_fields(measure)
+            content_str += f"[{label}] {'. '.join(fields)}.\n" if fields else f"[{label}] (no notes)\n"
+        return content_str, metadata
+
+    def _compact_measure(self, measure: Dict[str, Any]) -> str:
+        """ABC-like run-length encoding of one measure, e.g. "A4/8 E3/2*3 [C4E4G4]/2 | pp | ly: Gu-te".
+
+        Durations are note-value denominators (4 = quarter, 8 = eighth); "*n"
+        marks n repetitions of the same pitch and duration.
+        """
+        tokens = []
+        lyrics = []
+        for note in measure["notes"]:
+            pitch = note["pitches"][0] if len(note["pitches"]) == 1 else f"[{''.join(note['pitches'])}]"
+            token = f"{pitch}/{_DURATION_CODES.get(note['type'], note['type'])}"
+            if tokens and tokens[-1][0] == token:
+                tokens[-1][1] += 1
+            else:
+                tokens.append([token, 1])
+            if len(note["pitches"]) == 1 and note["lyric"]:
+                lyrics.append(note["lyric"])
+        
+        body = " ".join(token if count == 1 else f"{token}*{count}" for token, count in tokens) or "-"
+        if measure["dynamics"]:
+            body += f" | {' '.join(measure['dynamics'])}"
+        if lyrics:
+            body += f" | ly: {' '.join(lyrics)}"
+        return body
+
+    def _compact_content(self, chunk: List[Tuple[str, Dict[str, Any]]], part_names: List[str],
+                         measure_start: int, measure_end: int) -> str:
+        span = f"m{measure_start}" if measure_start == measure_end else f"m{measure_start}-{measure_end}"
+        if self.chunking != "vertical":
+            if len(chunk) == 1:
+                return f"{part_names[0]} {span}: {self._compact_measure(chunk[0][1])}\n"
+            lines = [f"{part_names[0]} {span}:"]
+            lines += [f"{measure['number']}: {self._compact_measure(measure)}" for _, measure in chunk]
+        else:
+            lines = [f"{span}:"]
+            for part_name, measure in chunk:
+                label = part_name if measure_start == measure_end else f"{measure['number']} {part_name}"
+                lines.append(f"{label}: {self._compact_measure(measure)}")
+        return "\n".join(lines) + "\n"
+
+# Batches allowed to wait between two ingestion stages
+INGEST_QUEUE_SIZE = int(os.environ.get("CLEF_INGEST_QUEUE_SIZE", "4"))
+
+# Parallel parsing settings; 1 worker keeps parsing in-process
+INDEX_WORKERS = int(os.environ.get("CLEF_INDEX_WORKERS", "1"))
+PARSE_TIMEOUT = float(os.environ.get("CLEF_PARSE_TIMEOUT", "0")) or None
+
+def split_levels(docs: List[Document]) -> Dict[str, List[Document]]:
+    """Group a file's Documents by kind: "measure" chunks, "summary" (score and
+    part level), "melody" and "lyrics"."""
+    levels: Dict[str, List[Document]] = {"measure": [], "summary": [], "melody": [], "lyrics": []}
+    for doc in docs:
+        level = doc.metadata.get("level", "measure")
+        levels["summary" if level in ("score", "part") else level].append(doc)
+    return levels
+
+def _parse_file(reader: "MusicXMLReader", file_path: Path) -> Tuple[Path, List[Document], Optional[str]]:
+    """Parse one file, returning (path, chunks and derived docs, error) instead of raising.
+
+    Module-level so it can be pickled into a process pool worker.
+    """
+    try:
+        return file_path, reader.load_data(file_path, derived=True), None
+    except Exception as e:
+        return file_path, [], str(e)
+
+class ParseTimeout(BaseException):
+    """Raised inside a pool worker when its file runs past the timeout.
+
+    A BaseException so that broad except clauses in music21 don't swallow it.
+    """
+
+def _raise_parse_timeout(signum, frame):
+    raise ParseTimeout()
+
+def _parse_file_with_timeout(reader: "MusicXMLReader", file_path: Path, timeout: float) -> Tuple[Path, List[Document], Optional[str]]:
+    """_parse_file in a pool worker, aborted after `timeout` seconds.
+
+    The timer is armed by the worker itself when it picks the file up, so
+    time spent queued behind other files does not count, and the worker
+    stays alive for the next file.
+    """
+    signal.signal(signal.SIGALRM, _raise_parse_timeout)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return _parse_file(reader, file_path)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except ParseTimeout:
+        return file_path, [], f"timed out after {timeout:g}s"
+
+def load_files_parallel(
+    files: Iterable[Path],
+    reader: Optional["MusicXMLReader"] = None,
+    workers: Optional[int] = None,
+    ordered: bool = True,
+    timeout: Optional[float] = None,
+    max_pending: Optional[int] = None,
+) -> Iterator[Tuple[Path, List[Document], Optional[str]]]:
+    """Parse MusicXML files with MusicXMLReader across a process pool.
+
+    Yields (file_path, docs, error) per file. With ordered=True results come
+    back in input order, otherwise as soon as each file finishes. A file that
+    fails to parse, runs longer than `timeout` seconds, or whose worker
+    crashes is reported with an error and an empty doc list without
+    affecting the other files. At most `max_pending` files (default 2 per
+    worker) are in flight or waiting to be consumed at once.
+
+    With a timeout, files are parsed in worker processes even for a single
+    worker: the timer is a SIGALRM, which only a process's main thread can
+    receive, and ingestion runs on the startup or upload threads.
+    """
+    files = list(files)
+    reader = reader or MusicXMLReader()
+    workers = workers or INDEX_WORKERS
+    if timeout and not hasattr(signal, "setitimer"):
+        print("Parse timeouts need SIGALRM, which this platform lacks; parsing without them")
+        timeout = None
+    if not timeout and (workers <= 1 or len(files) <= 1):
+        for file_path in files:
+            yield _parse_file(reader, file_path)
+        return
+    if not files:
+        return
+    
+    executor = ProcessPoolExecutor(max_workers=max(1, min(workers, len(files))))
+    # Submit lazily so parsed-but-unconsumed results stay bounded in memory
+    max_pending = max_pending or workers * 2
+    try:
+        futures: Dict[Any, int] = {}
+        pending = set()
+        submitted = 0
+        finished: Dict[int, Tuple[Path, List[Document], Optional[str]]] = {}
+        next_index = 0
+        
+        while pending or submitted < len(files):
+            while submitted < len(files) and len(pending) + len(finished) < max_pending:
+                if timeout:
+                    future = executor.submit(_parse_file_with_timeout, reader, files[submitted], timeout)
+                else:
+                    future = executor.submit(_parse_file, reader, files[submitted])
+                futures[future] = submitted
+                pending.add(future)
+                submitted += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                try:
+                    finished[i] = future.result()
+                except Exception as e:
+                    # Worker process died (e.g. out of memory); isolate the failure
+                    finished[i] = (files[i], [], f"worker failed: {e}")
+            
+            if ordered:
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+            else:
+                for i in list(finished):
+                    yield finished.pop(i)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def get_index(data_dir: str = "data/Catholic", persist_dir: str = "data/chromadb",
+              workers: Optional[int] = None, ordered: bool = True, backend: Optional[str] = None,
+              reader: Optional[MusicXMLReader] = None):
+    """Creates or loads the RAG index.
+
+    The persisted Chroma collection is reused as-is; only files that are new or
+    changed since the last run (per the manifest) are parsed and embedded, and
+    chunks of files that disappeared from data_dir are deleted. Stale files are
+    streamed through the ingest pipeline, so memory stays flat and each file is
+    committed to the manifest as soon as its chunks are written.
+    """
     
     # Configure settings based on current environment
-    _configure_settings()
+    configure_settings()
     
-    # Initialize ChromaDB
+    # Shared ChromaDB client, collections and index handle
     db_path = os.path.join(os.path.dirname(__file__), persist_dir)
-    chroma_client = chromadb.PersistentClient(path=db_path)
-    chroma_collection = chroma_client.get_or_create_collection("catholic_hymns")
-    
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    
-    # Check if we have documents to index
-    # In a real app, we might check if the index is empty or check for new files.
-    # For this demo, we'll just load everything if the collection is empty-ish or force reload.
-    
-    reader = MusicXMLReader()
-    all_docs = []
+    chroma_collection = get_collection(CHUNK_COLLECTION, persist_dir)
+    summary_collection = get_summary_collection(persist_dir)
+    index = get_vector_index(persist_dir)
     
     data_path = Path(os.path.join(os.path.dirname(__file__), data_dir))
     if not data_path.exists():
         print(f"Data directory {data_path} does not exist.")
         return None
 
-    # Only load if we explicitly want to re-index or if it's empty. 
-    # For now, let's just load a few files to test.
+    manifest_path = Path(db_path) / MANIFEST_NAME
+    # Collections built before the manifest existed carry no source_path metadata
+    legacy_collection = not manifest_path.exists() and chroma_collection.count() > 0
+    manifest = _load_manifest(manifest_path)
+    entries = manifest.setdefault("files", {})
     
     files = list(data_path.glob("*.xml")) + list(data_path.glob("*.mxl"))
     print(f"Found {len(files)} files in {data_path}")
     
-    for file_path in files:
-        print(f"Processing {file_path.name}...")
-        docs = reader.load_data(file_path)
-        all_docs.extend(docs)
+    # Drop chunks of files that were removed from this data dir
+    corpus_prefix = _source_key(data_path) + "/"
+    current_keys = {_source_key(f) for f in files}
+    for key in list(entries):
+        if key.startswith(corpus_prefix) and key not in current_keys:
+            print(f"Removing chunks of deleted file {key}...")
+            _delete_source_chunks(chroma_collection, key)
+            _delete_source_chunks(summary_collection, key)
+            _update_score_indexes(key, split_levels([]))
+            update_lexical_index([], get_measure_store().delete_source(key))
+            invalidate_answer_cache()
+            del entries[key]
+            _save_manifest(manifest_path, manifest)
+    
+    reader = reader or MusicXMLReader(backend=backend)
+    stale = [f for f in files if not _is_current(entries.get(_source_key(f)), f, reader.config_id)]
+    print(f"{len(files) - len(stale)} files up to date, {len(stale)} to index")
+    
+    # Summaries wait until the file's chunks are written, since they average their vectors
+    pending_summaries: Dict[Path, List[Document]] = {}
+    # Files whose chunks changed; cached answers are invalidated once they are written
+    changed_files: set = set()
+    
+    def parsed():
+        for file_path, docs, error in load_files_parallel(stale, reader=reader, workers=workers, ordered=ordered, timeout=PARSE_TIMEOUT):
+            print(f"Processing {file_path.name}...")
+            if error:
+                yield file_path, docs, error
+                continue
+            if legacy_collection:
+                chroma_collection.delete(where={"file_name": file_path.name})
+            levels = split_levels(docs)
+            docs = levels["measure"]
+            pending_summaries[file_path] = levels["summary"]
+            _update_score_indexes(_source_key(file_path), levels)
+            # Only chunks whose content changed go on to be embedded
+            changed, removed = _diff_file_docs(chroma_collection, _source_key(file_path), _tag_source(file_path, docs))
+            _update_lookup_stores(docs, changed, removed)
+            if changed or removed:
+                changed_files.add(file_path)
+            yield file_path, changed, error
+    
+    def write(docs: List[Document]):
+        if docs:
+            index.insert_nodes(docs)
+    
+    def on_file_done(file_path: Path, count: int, error: Optional[str]):
+        summaries = pending_summaries.pop(file_path, [])
+        if file_path in changed_files:
+            # Written (or, on error, at least deleted): answers cached before now may be stale
+            changed_files.discard(file_path)
+            invalidate_answer_cache()
+        if error:
+            # Leave the manifest entry stale so the file is retried next run
+            print(f"Skipping {file_path.name}: {error}")
+            return
+        _write_summaries(summary_collection, chroma_collection, file_path, summaries)
+        entries[_source_key(file_path)] = _manifest_entry(file_path, reader.config_id)
+        # Persist after every file so an interrupted run resumes where it stopped
+        _save_manifest(manifest_path, manifest)
+    
+    try:
+        written = run_pipeline(parsed(), embed_documents, write, on_file_done,
+                               batch_size=EMBED_BATCH_SIZE, queue_size=INGEST_QUEUE_SIZE)
+    finally:
+        if changed_files:
+            # Aborted with files whose old chunks were already deleted
+            invalidate_answer_cache()
+    if stale:
+        stats = get_embedding_cache().stats()
+        print(f"Indexed {written} chunks from {len(stale)} files "
+              f"(embedding cache: {stats['hits']} hits, {stats['misses']} misses)")
         
-    if not all_docs:
+    if chroma_collection.count() == 0:
         print("No documents extracted.")
         return None
-        
-    print(f"Indexing {len(all_docs)} chunks...")
-    index = VectorStoreIndex.from_documents(
-        all_docs, storage_context=storage_context
-    )
     
     return index
 
-def add_document_to_index(file_path: Path, index):
-    """Adds a single file to the existing index."""
+def embed_documents(docs: List[Document]):
+    """Attach embeddings to docs with one embedding call per batch.
+
+    Texts already in the embedding cache for the current model are not re-embedded.
+    """
+    texts = [doc.get_content(metadata_mode=MetadataMode.EMBED) for doc in docs]
+    embeddings = get_embedding_cache().embed(
+        texts, Settings.embed_model.get_text_embedding_batch, embed_model_id()
+    )
+    for doc, embedding in zip(docs, embeddings):
+        doc.embedding = embedding
+
+def insert_documents(index, docs: List[Document], batch_size: Optional[int] = None,
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Embed docs in batches and write each batch to the vector store in one call.
+
+    Replaces per-document index.insert(), which costs one embedding call and one
+    Chroma write per measure. on_progress(written, total) is called before the
+    first batch and after each one.
+    """
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    if on_progress:
+        on_progress(0, len(docs))
+    for start in range(0, len(docs), batch_size):
+        batch = docs[start:start + batch_size]
+        embed_documents(batch)
+        # Nodes that already carry embeddings go straight to the vector store
+        index.insert_nodes(batch)
+        if on_progress:
+            on_progress(start + len(batch), len(docs))
+    return len(docs)
+
+def _content_hash(doc: Document) -> str:
+    """Hash of everything about a chunk that ends up in the vector store.
+
+    Includes the embedding model, so switching models re-embeds every chunk
+    instead of leaving the old model's vectors in place.
+    """
+    metadata = {k: v for k, v in doc.metadata.items() if k not in ("source_path", "content_hash")}
+    payload = embed_model_id() + "\n" + doc.text + "\n" + json.dumps(metadata, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _tag_source(file_path: Path, docs: List[Document]) -> List[Document]:
+    """Give each chunk a deterministic id and content hash tied to its file.
+
+    The reader assigns ids unique within a file (part, measure range); they are
+    combined with the file's source key so the same measure of the same file
+    always maps to the same vector id.
+    """
+    source_key = _source_key(file_path)
+    for doc in docs:
+        doc.id_ = hashlib.sha1(f"{source_key}|{doc.id_}".encode("utf-8")).hexdigest()
+        doc.metadata["source_path"] = source_key
+        doc.metadata["content_hash"] = _content_hash(doc)
+        for key in ("source_path", "content_hash"):
+            doc.excluded_embed_metadata_keys.append(key)
+            doc.excluded_llm_metadata_keys.append(key)
+    return docs
+
+def _diff_file_docs(chroma_collection, source_key: str, docs: List[Document]) -> Tuple[List[Document], List[str]]:
+    """Compare a fresh parse of a file with its stored chunks.
+
+    Deletes chunks that disappeared or changed and returns (docs that still
+    need embedding and writing, ids of chunks that no longer exist). Unchanged
+    measures keep their vectors untouched.
+    """
+    existing = chroma_collection.get(where={"source_path": source_key}, include=["metadatas"])
+    stored = {
+        doc_id: (metadata or {}).get("content_hash")
+        for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+    new_ids = {doc.id_ for doc in docs}
+    changed = [doc for doc in docs if stored.get(doc.id_) != doc.metadata["content_hash"]]
+    # Chroma ignores adds for existing ids, so changed chunks are deleted first
+    removed_ids = [doc_id for doc_id in stored if doc_id not in new_ids]
+    stale_ids = removed_ids + [doc.id_ for doc in changed if doc.id_ in stored]
+    if stale_ids:
+        chroma_collection.delete(ids=stale_ids)
+    return changed, removed_ids
+
+def _update_lookup_stores(docs: List[Document], changed: List[Document], removed_ids: List[str]):
+    """Mirror a file's current chunks into the measure store and BM25 index.
+
+    Callers invalidate the answer cache once the changed chunks are written to
+    Chroma; invalidating earlier would let a question asked in between cache an
+    answer retrieved from the half-written index under the new version.
+    """
+    store = get_measure_store()
+    store.delete_ids(removed_ids)
+    store.upsert(docs)
+    update_lexical_index(docs, removed_ids)
+
+def _update_score_indexes(source_key: str, levels: Dict[str, List[Document]]):
+    """Refresh the melody, melodic similarity and lyrics indexes for one file."""
+    update_melody_index(source_key, levels["melody"])
+    update_melodic_similarity(source_key, levels["melody"])
+    update_lyrics_index(source_key, levels["lyrics"])
+
+def _write_file_docs(file_path: Path, docs: List[Document], index, chroma_collection,
+                     on_progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """(Re-)index one file's parsed docs, embedding only chunks that changed."""
+    source_key = _source_key(file_path)
+    changed, removed = _diff_file_docs(chroma_collection, source_key, _tag_source(file_path, docs))
+    _update_lookup_stores(docs, changed, removed)
+    print(f"{file_path.name}: {len(changed)} changed, {len(docs) - len(changed)} unchanged, "
+          f"{len(removed)} removed chunks")
+    try:
+        return insert_documents(index, changed, on_progress=on_progress)
+    finally:
+        if changed or removed:
+            # Only now does the index hold the new chunks
+            invalidate_answer_cache()
+
+def _summary_embedding(text_embedding: List[float], measure_vectors: List[List[float]]) -> List[float]:
+    """Blend a summary's own embedding with the centroid of its measure vectors."""
+    vector = np.asarray(text_embedding, dtype=np.float64)
+    vector /= np.linalg.norm(vector) or 1.0
+    if len(measure_vectors):
+        centroid = np.mean(np.asarray(measure_vectors, dtype=np.float64), axis=0)
+        vector += centroid / (np.linalg.norm(centroid) or 1.0)
+    return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+def _write_summaries(summary_collection, chroma_collection, file_path: Path, summaries: List[Document]):
+    """Replace a file's score/part summaries, once its chunks are in the vector store.
+
+    Each summary vector combines the embedded summary text (title, composer,
+    key, meter, lyrics incipit) with the mean of the measure vectors below it.
+    """
+    source_key = _source_key(file_path)
+    _delete_source_chunks(summary_collection, source_key)
+    if not summaries:
+        return
+    _tag_source(file_path, summaries)
+    embed_documents(summaries)
+    
+    stored = chroma_collection.get(where={"source_path": source_key}, include=["embeddings", "metadatas"])
+    part_vectors: Dict[str, List[List[float]]] = {}
+    for embedding, metadata in zip(stored["embeddings"], stored["metadatas"]):
+        part_vectors.setdefault((metadata or {}).get("instrument"), []).append(embedding)
+    all_vectors = [vector for vectors in part_vectors.values() for vector in vectors]
+    for doc in summaries:
+        # Vertical chunks mix all parts, so part summaries fall back to the whole score
+        vectors = all_vectors if doc.metadata["level"] == "score" else part_vectors.get(doc.metadata["instrument"], all_vectors)
+        doc.embedding = _summary_embedding(doc.embedding, vectors)
+    
+    summary_collection.upsert(
+        ids=[doc.id_ for doc in summaries],
+        embeddings=[doc.embedding for doc in summaries],
+        documents=[doc.text for doc in summaries],
+        metadatas=[doc.metadata for doc in summaries],
+    )
+
+# Uploads are indexed concurrently; manifest updates must not overwrite each other
+_manifest_lock = threading.Lock()
+
+def add_document_to_index(file_path: Path, index, persist_dir: str = "data/chromadb",
+                          on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """Adds a single file to the existing index.
+
+    Returns the file's chunk count and how many of them were (re-)embedded;
+    on_progress(embedded, to_embed) reports progress while embedding.
+    """
+    manifest_path = Path(os.path.join(os.path.dirname(__file__), persist_dir)) / MANIFEST_NAME
+    source_key = _source_key(file_path)
     reader = MusicXMLReader()
-    docs = reader.load_data(file_path)
-    if docs:
-        for doc in docs:
-            index.insert(doc)
-        print(f"Added {len(docs)} chunks from {file_path.name}")
+    chroma_collection = index.vector_store.client
+    if _is_current(_load_manifest(manifest_path).get("files", {}).get(source_key), file_path, reader.config_id):
+        print(f"{file_path.name} is already indexed and unchanged")
+        if on_progress:
+            on_progress(0, 0)
+        existing = chroma_collection.get(where={"source_path": source_key}, include=[])
+        return {"chunks": len(existing["ids"]), "embedded": 0}
+    
+    levels = split_levels(reader.load_data(file_path, derived=True))
+    docs = levels["measure"]
+    count = _write_file_docs(file_path, docs, index, chroma_collection, on_progress=on_progress)
+    _update_score_indexes(source_key, levels)
+    _write_summaries(get_summary_collection(persist_dir), chroma_collection, file_path, levels["summary"])
+    with _manifest_lock:
+        # Re-read so entries written by other uploads in the meantime are kept
+        manifest = _load_manifest(manifest_path)
+        manifest.setdefault("files", {})[source_key] = _manifest_entry(file_path, reader.config_id)
+        _save_manifest(manifest_path, manifest)
+    if count:
+        print(f"Added {count} chunks from {file_path.name}")
+    elif docs:
+        print(f"No measures changed in {file_path.name}")
     else:
         print(f"No documents extracted from {file_path.name}")
+    return {"chunks": len(docs), "embedded": count}
 
 if __name__ == "__main__":
     # Test run
@@ -0,0 +1,94 @@
+"""
+Cross-encoder reranking with a latency budget.
+
+Retrieval over-fetches candidates; a small CPU cross-encoder scores every
+(question, chunk) pair and only the best few reach the synthesizer, which
+keeps prompts short. If scoring does not finish within the budget the
+candidates are passed on in retrieval order instead, so reranking can only
+ever cost budget_ms.
+
+Needs the optional sentence-transformers package; without it, or if the
+model fails to load, retrieval order is kept.
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+RERANK_ENABLED = os.environ.get("CLEF_RERANK", "0") == "1"
+RERANK_MODEL = os.environ.get("CLEF_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched for reranking and the time allowed to score them
+RERANK_CANDIDATES = int(os.environ.get("CLEF_RERANK_CANDIDATES", "10"))
+RERANK_BUDGET_MS = float(os.environ.get("CLEF_RERANK_BUDGET_MS", "300"))
+
+_models: Dict[str, object] = {}
+_model_lock = threading.Lock()
+# One scoring call at a time; a call that overran its budget delays the next one instead of piling up
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+def get_cross_encoder(model_name: str = RERANK_MODEL):
+    """Load a cross-encoder once per process; None if it is unavailable."""
+    with _model_lock:
+        if model_name not in _models:
+            try:
+                from sentence_transformers import CrossEncoder
+                _models[model_name] = CrossEncoder(model_name, device="cpu")
+            except Exception as e:
+                print(f"Reranking disabled, could not load {model_name}: {e}")
+                _models[model_name] = None
+        return _models[model_name]
+
+def warm_cross_encoder(model_name: str = RERANK_MODEL):
+    """Start loading the model in the rerank thread so the first query stays within budget."""
+    _pool.submit(get_cross_encoder, model_name)
+
+def _score(model_name: str, query: str, texts: List[str]) -> Optional[List[float]]:
+    model = get_cross_encoder(model_name)
+    if model is None:
+        return None
+    return [float(score) for score in model.predict([(query, text) for text in texts])]
+
+class BudgetedRerank(BaseNodePostprocessor):
+    """Rerank nodes with a cross-encoder, falling back to input order past the budget."""
+
+    model: str = Field(default=RERANK_MODEL)
+    top_n: int = Field(default=2)
+    budget_ms: float = Field(default=RERANK_BUDGET_MS)
+    last_timings: Dict[str, float] = Field(default_factory=dict)
+    timeouts: int = Field(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BudgetedRerank"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore],
+                           query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if query_bundle is None or len(nodes) <= 1:
+            return nodes[:self.top_n]
+        texts = [node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        start = time.perf_counter()
+        future = _pool.submit(_score, self.model, query_bundle.query_str, texts)
+        try:
+            scores = future.result(timeout=self.budget_ms / 1000)
+        except TimeoutError:
+            future.cancel()
+            scores = None
+            self.timeouts += 1
+        except Exception as e:
+            print(f"Rerank failed: {e}")
+            scores = None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.last_timings = {"rerank_ms": elapsed_ms}
+        if scores is None:
+            print(f"Rerank skipped after {elapsed_ms:.0f} ms; keeping retrieval order")
+            return nodes[:self.top_n]
+
+        ranked = sorted(zip(nodes, scores), key=lambda pair: pair[1], reverse=True)[:self.top_n]
+        print(f"Reranked {len(nodes)} candidates in {elapsed_ms:.1f} ms")
+        return [NodeWithScore(node=node.node, score=score) for node, score in ranked]
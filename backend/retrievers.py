@@ -0,0 +1,291 @@
+"""
+Custom LlamaIndex retrievers used by the agent.
+
+HybridRetriever runs dense vector search (Chroma) and BM25 lexical search
+(lexical_index) in parallel and merges both rankings with reciprocal rank
+fusion, so exact tokens such as F#4, mf or Korean lyric syllables are found
+even when the embedding model misses them.
+
+HierarchicalRetriever first ranks score-level summaries (one vector per
+hymn), or part-level ones when the query is about a part, and then searches
+measures only inside the best-matching scores, so retrieval cost grows with
+the number of hymns rather than measures.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.vector_stores import MetadataFilter, MetadataFilters, FilterCondition, FilterOperator
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from lexical_index import get_lexical_index
+from measure_store import get_measure_store
+
+# Chunks handed to the synthesizer, and candidates fetched from each retriever
+SIMILARITY_TOP_K = int(os.environ.get("CLEF_SIMILARITY_TOP_K", "2"))
+HYBRID_CANDIDATES = int(os.environ.get("CLEF_HYBRID_CANDIDATES", "10"))
+RRF_K = 60
+# Scores kept by the first stage of hierarchical retrieval
+SCORE_TOP_K = int(os.environ.get("CLEF_SCORE_TOP_K", "3"))
+
+# Bookkeeping metadata that should not reach the LLM
+_HIDDEN_KEYS = ["source_path", "content_hash"]
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+def _timed(fn: Callable, *args) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def _matches(metadata: Dict[str, Any], filters: MetadataFilters) -> bool:
+    """Evaluate MetadataFilters against a metadata dict, as Chroma would."""
+    results = []
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters):
+            results.append(_matches(metadata, f))
+            continue
+        value = metadata.get(f.key)
+        op = f.operator
+        try:
+            if op == FilterOperator.EQ:
+                ok = value == f.value
+            elif op == FilterOperator.NE:
+                ok = value != f.value
+            elif op == FilterOperator.IN:
+                ok = value in f.value
+            elif op == FilterOperator.NIN:
+                ok = value not in f.value
+            elif op == FilterOperator.LT:
+                ok = value is not None and value < f.value
+            elif op == FilterOperator.LTE:
+                ok = value is not None and value <= f.value
+            elif op == FilterOperator.GT:
+                ok = value is not None and value > f.value
+            elif op == FilterOperator.GTE:
+                ok = value is not None and value >= f.value
+            else:
+                ok = True
+        except TypeError:
+            ok = False
+        results.append(ok)
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+# Filter keys stored as measure store columns; anything else is read from the metadata JSON
+_STORE_COLUMNS = {"source_path", "file_name", "title", "instrument", "measure_start", "measure_end"}
+_SQL_OPERATORS = {
+    FilterOperator.EQ: "=", FilterOperator.NE: "!=", FilterOperator.LT: "<",
+    FilterOperator.LTE: "<=", FilterOperator.GT: ">", FilterOperator.GTE: ">=",
+}
+
+def _filter_sql(filters: MetadataFilters) -> Optional[Tuple[str, List[Any]]]:
+    """Translate MetadataFilters into an SQL condition on the measure store, or None if unsupported."""
+    clauses, params = [], []
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters):
+            nested = _filter_sql(f)
+            if nested is None:
+                return None
+            clauses.append(f"({nested[0]})")
+            params += nested[1]
+            continue
+        if not f.key.isidentifier():
+            return None
+        column = f.key if f.key in _STORE_COLUMNS else f"json_extract(metadata, '$.{f.key}')"
+        if f.operator in _SQL_OPERATORS:
+            clauses.append(f"{column} {_SQL_OPERATORS[f.operator]} ?")
+            params.append(f.value)
+        elif f.operator in (FilterOperator.IN, FilterOperator.NIN):
+            values = list(f.value)
+            if not values:
+                clauses.append("0" if f.operator == FilterOperator.IN else "1")
+                continue
+            negate = "NOT " if f.operator == FilterOperator.NIN else ""
+            clauses.append(f"{column} {negate}IN ({','.join('?' * len(values))})")
+            params += values
+        else:
+            return None
+    if not clauses:
+        return "1", []
+    joiner = " OR " if filters.condition == FilterCondition.OR else " AND "
+    return joiner.join(clauses), params
+
+def reciprocal_rank_fusion(result_lists: List[List[NodeWithScore]], top_k: int, k: int = RRF_K) -> List[NodeWithScore]:
+    """Merge ranked lists by summing 1 / (k + rank) per node."""
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, Any] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            node_id = result.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            nodes.setdefault(node_id, result.node)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in ranked]
+
+class HybridRetriever(BaseRetriever):
+    """Vector + BM25 retrieval merged with reciprocal rank fusion.
+
+    Both retrievers honour the same metadata filters. Latencies of the last
+    query are kept in last_timings (milliseconds).
+    """
+
+    def __init__(self, index, filters: Optional[MetadataFilters] = None,
+                 top_k: Optional[int] = None, candidates: Optional[int] = None):
+        super().__init__()
+        self._top_k = top_k or SIMILARITY_TOP_K
+        self._candidates = max(candidates or HYBRID_CANDIDATES, self._top_k)
+        self._filters = filters
+        self._vector_store = index.vector_store
+        self.last_timings: Dict[str, float] = {}
+
+    def _vector_retrieve(self, query_bundle: QueryBundle, filters: Optional[MetadataFilters]) -> List[NodeWithScore]:
+        embedding = query_bundle.embedding or Settings.embed_model.get_query_embedding(query_bundle.query_str)
+        result = self._vector_store.query(VectorStoreQuery(
+            query_embedding=embedding, similarity_top_k=self._candidates,
+            query_str=query_bundle.query_str, filters=filters,
+        ))
+        similarities = result.similarities or [None] * len(result.nodes or [])
+        return [NodeWithScore(node=node, score=score) for node, score in zip(result.nodes or [], similarities)]
+
+    def _lexical_retrieve(self, query_str: str, filters: Optional[MetadataFilters]) -> List[NodeWithScore]:
+        store = get_measure_store()
+        allowed, post_filter = None, None
+        if filters:
+            # Score only the chunks the filters allow, found by SQL on the measure store
+            where = _filter_sql(filters)
+            if where is not None:
+                allowed = store.matching_ids(*where)
+            else:
+                post_filter = filters
+        # Filters the store cannot express are applied after scoring, so over-fetch for them
+        fetch = self._candidates * 5 if post_filter else self._candidates
+        hits = get_lexical_index().search(query_str, top_k=fetch, allowed=allowed)
+        chunks = store.get([doc_id for doc_id, _ in hits])
+        results = []
+        for doc_id, score in hits:
+            chunk = chunks.get(doc_id)
+            if chunk is None or (post_filter and not _matches(chunk["metadata"], post_filter)):
+                continue
+            node = TextNode(
+                id_=doc_id,
+                text=chunk["text"],
+                metadata=chunk["metadata"],
+                excluded_embed_metadata_keys=list(_HIDDEN_KEYS),
+                excluded_llm_metadata_keys=list(_HIDDEN_KEYS),
+            )
+            results.append(NodeWithScore(node=node, score=score))
+            if len(results) >= self._candidates:
+                break
+        return results
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self.retrieve_filtered(query_bundle, self._filters)
+
+    def retrieve_filtered(self, query_bundle: QueryBundle, filters: Optional[MetadataFilters]) -> List[NodeWithScore]:
+        """Retrieve with the given filters in place of the constructor's (safe to call concurrently)."""
+        vector_future = _pool.submit(_timed, self._vector_retrieve, query_bundle, filters)
+        lexical_future = _pool.submit(_timed, self._lexical_retrieve, query_bundle.query_str, filters)
+        vector_nodes, vector_ms = vector_future.result()
+        lexical_nodes, lexical_ms = lexical_future.result()
+
+        start = time.perf_counter()
+        fused = reciprocal_rank_fusion([vector_nodes, lexical_nodes], self._top_k)
+        fusion_ms = (time.perf_counter() - start) * 1000
+        self.last_timings = {"vector_ms": vector_ms, "lexical_ms": lexical_ms, "fusion_ms": fusion_ms}
+        print(f"Hybrid retrieval: vector {vector_ms:.1f} ms ({len(vector_nodes)} hits), "
+              f"lexical {lexical_ms:.1f} ms ({len(lexical_nodes)} hits), fusion {fusion_ms:.2f} ms")
+        return fused
+
+def _summary_where(filters: Optional[MetadataFilters]) -> Dict[str, Any]:
+    """Chroma where clause selecting the summaries that can satisfy the chunk filters.
+
+    An instrument filter selects part summaries of those parts; a measure
+    filter excludes summaries of parts or scores shorter than the measure.
+    Filters without a summary counterpart are left to the second stage.
+    """
+    instruments: Optional[List[str]] = None
+    min_measures = None
+    if filters and filters.condition != FilterCondition.OR:
+        for f in filters.filters:
+            if isinstance(f, MetadataFilters):
+                continue
+            if f.key == "instrument" and f.operator in (FilterOperator.EQ, FilterOperator.IN):
+                values = f.value if f.operator == FilterOperator.IN else [f.value]
+                # Vertical chunks ("All Parts") have no part summary of their own
+                instruments = [value for value in values if value != "All Parts"]
+            elif f.key == "measure_start" and f.operator == FilterOperator.LTE:
+                min_measures = f.value
+    clauses: List[Dict[str, Any]] = [{"level": "part" if instruments else "score"}]
+    if instruments:
+        clauses.append({"instrument": {"$in": instruments}})
+    if min_measures is not None:
+        clauses.append({"measure_count": {"$gte": min_measures}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+class HierarchicalRetriever(BaseRetriever):
+    """Two-stage retrieval: top scores by summary vector, then measures within them.
+
+    Stage one queries the summaries in summary_collection: score-level ones,
+    or the part-level ones of the requested part, narrowed by the same
+    filters as the chunks. Stage two runs HybridRetriever restricted to
+    those scores' chunks. Queries that already name a score (title or
+    file_name filter), or a corpus without summaries, skip straight to stage
+    two, as does a query whose scoped search finds nothing.
+    """
+
+    def __init__(self, index, summary_collection, filters: Optional[MetadataFilters] = None,
+                 top_k: Optional[int] = None, score_top_k: Optional[int] = None):
+        super().__init__()
+        self._summaries = summary_collection
+        self._filters = filters
+        self._score_top_k = score_top_k or SCORE_TOP_K
+        self._summary_where = _summary_where(filters)
+        self._hybrid = HybridRetriever(index, filters=filters, top_k=top_k)
+        self.last_timings: Dict[str, float] = {}
+
+    def _names_score(self) -> bool:
+        return bool(self._filters) and any(
+            getattr(f, "key", None) in ("title", "file_name") for f in self._filters.filters
+        )
+
+    def _top_sources(self, query_bundle: QueryBundle) -> List[str]:
+        embedding = query_bundle.embedding or Settings.embed_model.get_query_embedding(query_bundle.query_str)
+        # Several parts of one score can match, so fetch extra and keep distinct scores
+        per_score = 1 if self._summary_where.get("level") == "score" else 4
+        result = self._summaries.query(
+            query_embeddings=[embedding], n_results=self._score_top_k * per_score,
+            where=self._summary_where, include=["metadatas"],
+        )
+        sources = dict.fromkeys(metadata["source_path"] for metadata in result["metadatas"][0])
+        return list(sources)[:self._score_top_k]
+
+    def _scoped_filters(self, sources: List[str]) -> MetadataFilters:
+        scope = MetadataFilter(key="source_path", value=sources, operator=FilterOperator.IN)
+        if not self._filters:
+            return MetadataFilters(filters=[scope])
+        if self._filters.condition == FilterCondition.OR:
+            return MetadataFilters(filters=[scope, self._filters], condition=FilterCondition.AND)
+        return MetadataFilters(filters=[scope, *self._filters.filters], condition=FilterCondition.AND)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if self._names_score() or self._summaries.count() == 0:
+            return self._hybrid.retrieve(query_bundle)
+        
+        sources, scores_ms = _timed(self._top_sources, query_bundle)
+        if not sources:
+            return self._hybrid.retrieve(query_bundle)
+        nodes, measures_ms = _timed(self._hybrid.retrieve_filtered, query_bundle, self._scoped_filters(sources))
+        self.last_timings = {"scores_ms": scores_ms, "measures_ms": measures_ms}
+        print(f"Hierarchical retrieval: {len(sources)} scores in {scores_ms:.1f} ms, "
+              f"{len(nodes)} measures in {measures_ms:.1f} ms")
+        if not nodes:
+            # The summaries picked scores whose chunks the filters rule out
+            return self._hybrid.retrieve(query_bundle)
+        return nodes
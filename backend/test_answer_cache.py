@@ -0,0 +1,53 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, key_terms
+
+def test_answer_cache_key_terms():
+    cache = SemanticAnswerCache(max_size=8, threshold=0.95)
+    base = np.ones(16, dtype=np.float32)
+    near = base.copy()
+    near[0] += 0.01  # cosine similarity ~1, as for two questions differing in one word
+
+    cache.put("notes in measure 5 of the bass", base, ["a"], "bass m5", cache.index_version)
+
+    # Same wording, different measure and part: must not reuse the answer
+    assert cache.lookup(near, "notes in measure 6 of the tenor") is None
+    assert cache.lookup(near, "notes in measure 6 of the bass") is None
+    assert cache.lookup(near, "notes in measure 5 of the tenor") is None
+    assert cache.lookup(near, 'notes in measure 5 of the bass in "Gute Nacht"') is None
+
+    # Rephrasing with the same numbers and part is a hit
+    hit = cache.lookup(near, "What does the Bass sing in measure 5?")
+    assert hit is not None and hit["answer"] == "bass m5"
+
+    # A different question with the same terms but an unrelated embedding misses
+    far = np.zeros(16, dtype=np.float32)
+    far[0] = 1.0
+    assert cache.lookup(far, "bass measure 5") is None
+
+    assert key_terms("Basses in bar 05")[:2] == (("5",), frozenset({"bass"}))
+    print("Answer cache key term checks passed.")
+
+def test_answer_cache_retrieval_keys():
+    cache = SemanticAnswerCache(max_size=8, threshold=0.95)
+    base = np.ones(16, dtype=np.float32)
+    near = base.copy()
+    near[0] += 0.01
+
+    # Unquoted titles are invisible to key_terms; the extracted keys tell them apart
+    leiermann = {"title": "Der Leiermann", "measure_number": None, "instrument": None, "file_name": None}
+    cache.put("첫 소절 가사 알려줘 Der Leiermann", base, ["a"], "leiermann", cache.index_version, leiermann)
+    assert cache.lookup(near, "첫 소절 가사 알려줘 Gute Nacht", {**leiermann, "title": "Gute Nacht"}) is None
+    assert cache.lookup(near, "첫 소절 가사 알려줘 Gute Nacht") is None
+
+    # Same score, case-insensitively, is a hit
+    hit = cache.lookup(near, "첫 소절 가사 알려줘 der leiermann", {**leiermann, "title": "der leiermann"})
+    assert hit is not None and hit["answer"] == "leiermann"
+
+if __name__ == "__main__":
+    test_answer_cache_key_terms()
+    test_answer_cache_retrieval_keys()
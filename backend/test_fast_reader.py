@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+from pathlib import Path
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from rag_indexer import MusicXMLReader, CHUNKING_STRATEGIES, ENCODINGS
+
+TEST_DIR = Path(os.path.dirname(__file__)) / ".." / "MusicXML_test"
+
+def test_fast_reader():
+    test_files = sorted(f for f in TEST_DIR.glob("*") if f.suffix in (".xml", ".mxl"))
+    assert test_files, f"No MusicXML files in {TEST_DIR}"
+
+    for test_file in test_files:
+        for chunking in CHUNKING_STRATEGIES:
+            for encoding in ENCODINGS:
+                timings = {}
+                docs = {}
+                for backend in ("music21", "etree"):
+                    start = time.perf_counter()
+                    reader = MusicXMLReader(backend=backend, chunking=chunking, encoding=encoding)
+                    docs[backend] = reader.load_data(test_file, derived=True)
+                    timings[backend] = time.perf_counter() - start
+
+                expected, actual = docs["music21"], docs["etree"]
+                label = f"{test_file.name} ({chunking}, {encoding})"
+                assert [doc.id_ for doc in actual] == [doc.id_ for doc in expected], f"{label}: document ids differ"
+                for a, b in zip(expected, actual):
+                    assert b.text == a.text, f"{label}: text of {a.id_} differs:\n{a.text}\n---\n{b.text}"
+                    assert b.metadata == a.metadata, f"{label}: metadata of {a.id_} differs"
+                print(f"{label}: {len(expected)} identical documents, "
+                      f"music21 {timings['music21']:.3f}s, etree {timings['etree']:.3f}s")
+
+if __name__ == "__main__":
+    test_fast_reader()
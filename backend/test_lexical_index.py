@@ -0,0 +1,47 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from lexical_index import BM25Index
+
+def test_bm25_remove_and_reindex():
+    index = BM25Index()
+    index.add("a", "Ave Maria gratia plena")
+    index.add("b", "Salve Regina mater misericordiae")
+    index.add("c", "Ave verum corpus")
+    assert len(index) == 3
+    assert {doc_id for doc_id, _ in index.search("ave")} == {"a", "c"}
+
+    # Removing a document drops its postings and its length from the averages
+    index.remove("a")
+    assert len(index) == 2
+    assert [doc_id for doc_id, _ in index.search("ave")] == ["c"]
+    assert index.search("gratia plena") == []
+    assert "gratia" not in index._postings and "plena" not in index._postings
+    assert index._total_length == sum(index._doc_lengths.values())
+
+    # Removing an unknown document is a no-op
+    index.remove("a")
+    assert len(index) == 2
+
+    # Re-adding a document replaces its old terms instead of accumulating them
+    index.add("c", "Tantum ergo sacramentum")
+    assert index.search("ave") == []
+    assert [doc_id for doc_id, _ in index.search("tantum")] == ["c"]
+    assert "verum" not in index._postings
+    assert index._total_length == sum(index._doc_lengths.values())
+
+    # A fresh index over the same documents scores identically
+    fresh = BM25Index()
+    fresh.add("b", "Salve Regina mater misericordiae")
+    fresh.add("c", "Tantum ergo sacramentum")
+    for query in ("salve", "tantum ergo", "regina sacramentum"):
+        assert index.search(query) == fresh.search(query)
+
+    index.add("a", "Ave Maria gratia plena")
+    assert [doc_id for doc_id, _ in index.search("gratia")] == ["a"]
+    assert index.search("ave", allowed={"b"}) == []
+
+if __name__ == "__main__":
+    test_bm25_remove_and_reindex()
+    print("BM25 remove/reindex checks passed")
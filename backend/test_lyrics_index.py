@@ -0,0 +1,66 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from lyrics_index import LyricsIndex
+
+def _metadata(name, verse="1"):
+    return {"source_path": f"/scores/{name}.mxl", "file_name": f"{name}.mxl", "title": name,
+            "instrument": "Soprano", "verse": verse}
+
+def _add(index, verse_id, name, text):
+    # One word per measure
+    measures, number = [], 1
+    for char in text:
+        measures.append(number)
+        if char == " ":
+            number += 1
+    index.add(verse_id, text, measures, _metadata(name))
+
+def test_lyrics_remove_and_reindex():
+    index = LyricsIndex()
+    _add(index, "ave|1", "ave", "Ave Maria, gratia plena")
+    _add(index, "salve|1", "salve", "Salve Regina, mater misericordiae")
+    hits = index.search("gratia plena")
+    assert [hit["source_path"] for hit in hits] == ["/scores/ave.mxl"]
+    assert hits[0]["exact"] and hits[0]["text"] == "gratia plena"
+    assert (hits[0]["measure_start"], hits[0]["measure_end"]) == (3, 4)
+
+    # Removing a verse drops it from every bigram and character posting
+    index.remove("ave|1")
+    assert len(index) == 1
+    assert index.search("gratia plena") == []
+    assert index.search("gratia plenx") == []
+    for postings in (index._postings, index._unigrams):
+        assert all(verse_ids and verse_ids <= {"salve|1"} for verse_ids in postings.values())
+
+    # Removing an unknown verse is a no-op
+    index.remove("ave|1")
+    assert len(index) == 1
+
+    # Re-adding an id with new text replaces the old postings
+    _add(index, "salve|1", "salve", "Regina caeli laetare")
+    assert index.search("misericordiae") == []
+    assert [hit["text"] for hit in index.search("caeli")] == ["caeli"]
+
+    _add(index, "ave|1", "ave", "Ave Maria, gratia plena")
+    assert [hit["source_path"] for hit in index.search("ave maria")] == ["/scores/ave.mxl"]
+    assert len(index) == 2
+
+def test_lyrics_fuzzy_needs_nearby_bigrams():
+    index = LyricsIndex()
+    _add(index, "leiermann|1", "leiermann",
+         "Drüben hinterm Dorfe steht ein Leiermann, und mit starren Fingern dreht er, was er kann, "
+         "barfuß auf dem Eise wankt er hin und her, und sein kleiner Teller bleibt ihm immer leer")
+
+    # A misspelt line of the verse is an approximate hit on that line
+    hits = index.search("Drüben hintem Dorfe steht")
+    assert [(hit["text"], hit["exact"]) for hit in hits] == [("Drüben hinterm Dorfe steht", False)]
+
+    # Most bigrams of this line occur somewhere in the long verse, but not together
+    assert index.search("Fremd bin ich eingezogen") == []
+
+if __name__ == "__main__":
+    test_lyrics_remove_and_reindex()
+    test_lyrics_fuzzy_needs_nearby_bigrams()
+    print("Lyrics index remove/reindex checks passed")
@@ -0,0 +1,89 @@
+import os
+import sys
+import random
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import numpy as np
+
+from melodic_similarity import FEATURE_DIM, SimilarityTable, melodic_features
+from melody_index import encode_melody
+
+def _brute_force(vectors, source_path, k):
+    ranked = sorted(((float(np.dot(vectors[source_path], vector)), other)
+                     for other, vector in vectors.items() if other != source_path), reverse=True)
+    return [other for _, other in ranked[:k]]
+
+def _check(table, vectors, k):
+    for source_path in vectors:
+        similar = table.similar(source_path, limit=k)
+        assert [hit["source_path"] for hit in similar] == _brute_force(vectors, source_path, k), source_path
+        for hit in similar:
+            expected = float(np.dot(vectors[source_path], vectors[hit["source_path"]]))
+            assert abs(hit["similarity"] - expected) < 1e-5
+
+def test_similarity_table_matches_brute_force():
+    rng = np.random.default_rng(0)
+    random.seed(0)
+    k = 4
+    vectors = {}
+
+    def unit():
+        vector = rng.standard_normal(FEATURE_DIM).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "similarity.sqlite3")
+        table = SimilarityTable(path, k=k)
+        for step in range(200):
+            action = random.random()
+            if vectors and action < 0.25:
+                source_path = random.choice(sorted(vectors))
+                table.remove(source_path)
+                del vectors[source_path]
+            elif vectors and action < 0.5:
+                # Replace an existing score's features
+                source_path = random.choice(sorted(vectors))
+                vectors[source_path] = unit()
+                table.upsert(source_path, f"{source_path}.mxl", source_path, vectors[source_path])
+            else:
+                source_path = f"score-{step}"
+                vectors[source_path] = unit()
+                table.upsert(source_path, f"{source_path}.mxl", source_path, vectors[source_path])
+            assert len(table) == len(vectors)
+            _check(table, vectors, k)
+
+        # Removing an unknown score is a no-op
+        table.remove("missing")
+        _check(table, vectors, k)
+
+        # Neighbour lists persisted in SQLite are reloaded as they were
+        reloaded = SimilarityTable(path, k=k)
+        assert len(reloaded) == len(vectors)
+        _check(reloaded, vectors, k)
+
+def test_features_of_two_voice_part_match_its_melody():
+    # Melody in quarters over a half-note bass line on the same staff, in document order
+    tune = ["G4", "A4", "B4", "G4", "D5", "C5", "B4", "A4", "G4", "B4", "A4", "G4"]
+    bass = ["G2", "D3", "G2", "D3", "C3", "D3"]
+    melody, staff = [], []
+    for number in range(3):
+        upper = [{"pitches": [pitch], "type": "quarter", "offset": float(i)}
+                 for i, pitch in enumerate(tune[number * 4:number * 4 + 4])]
+        lower = [{"pitches": [pitch], "type": "half", "offset": 2.0 * i}
+                 for i, pitch in enumerate(bass[number * 2:number * 2 + 2])]
+        melody.append({"number": number + 1, "notes": upper})
+        staff.append({"number": number + 1, "notes": upper + lower})
+
+    single = melodic_features(encode_melody(melody))
+    both = melodic_features(encode_melody(staff))
+    assert float(np.dot(single, both)) > 0.999
+
+    # Without the per-onset reduction the bass line would pull the vector away
+    interleaved = " ".join(f"{m}:{p}:1" for m, p in [(1, 67), (1, 43), (1, 69), (1, 50)] * 3)
+    assert float(np.dot(single, melodic_features(interleaved))) < 0.9
+
+if __name__ == "__main__":
+    test_similarity_table_matches_brute_force()
+    test_features_of_two_voice_part_match_its_melody()
+    print("Similarity table matches brute-force kNN")
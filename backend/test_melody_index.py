@@ -0,0 +1,86 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+from melody_index import MelodyIndex, encode_melody
+
+def _melody(pitches, note_type="quarter"):
+    # Four notes per measure
+    measures = [{"number": i // 4 + 1, "notes": []} for i in range(0, len(pitches), 4)]
+    ql = {"quarter": 1.0, "half": 2.0}[note_type]
+    for i, pitch in enumerate(pitches):
+        measures[i // 4]["notes"].append({"pitches": [pitch], "type": note_type, "offset": (i % 4) * ql})
+    return encode_melody(measures)
+
+def _metadata(name):
+    return {"source_path": f"/scores/{name}.mxl", "file_name": f"{name}.mxl", "title": name, "instrument": "Soprano"}
+
+def _sources(results):
+    return [hit["source_path"] for hit in results]
+
+MARY = ["E4", "D4", "C4", "D4", "E4", "E4", "E4", "D4", "D4", "D4", "E4", "G4", "G4"]
+SCALE = ["C4", "D4", "E4", "F4", "G4", "A4", "B4", "C5"]
+
+def test_melody_remove_and_reindex():
+    index = MelodyIndex(n=3)
+    index.add("mary|s", _melody(MARY), _metadata("mary"))
+    index.add("scale|s", _melody(SCALE), _metadata("scale"))
+    query = [64, 62, 60, 62, 64]  # E D C D E
+    assert _sources(index.search(query, [1.0] * 5)) == ["/scores/mary.mxl"]
+
+    # Removing a part empties every posting list it contributed to
+    index.remove("mary|s")
+    assert len(index) == 1
+    assert index.search(query, [1.0] * 5) == []
+    assert index.search(query, None, octaves_known=False) == []
+    for postings_by_gram in (index._interval_postings, index._class_postings, index._rhythm_postings):
+        for postings in postings_by_gram.values():
+            assert all(postings[i] in index._parts for i in range(0, len(postings), 2))
+    assert _sources(index.search([60, 62, 64, 65], [1.0] * 4)) == ["/scores/scale.mxl"]
+
+    # Removing an unknown part is a no-op
+    index.remove("mary|s")
+    assert len(index) == 1
+
+    # Re-adding the same id with another melody replaces the old postings
+    index.add("scale|s", _melody(MARY, "half"), _metadata("scale"))
+    assert len(index) == 1
+    assert index.search([60, 62, 64, 65], [1.0] * 4) == []
+    hit = index.search(query, [2.0] * 5)[0]
+    assert hit["source_path"] == "/scores/scale.mxl"
+    assert (hit["measure_start"], hit["measure_end"]) == (1, 2)
+
+    index.add("mary|s", _melody(MARY), _metadata("mary"))
+    assert len(index) == 2
+    assert set(_sources(index.search(query, [1.0] * 5))) == {"/scores/mary.mxl", "/scores/scale.mxl"}
+
+def _note(pitch, note_type, offset):
+    return {"pitches": [pitch], "type": note_type, "offset": offset}
+
+def test_encode_two_voice_staff():
+    # Voice 1 sings E D C D | E E E(half); voice 2 holds half notes below it and
+    # moves in eighths under the held E of measure 2
+    voice_1 = [
+        [_note("E4", "quarter", 0.0), _note("D4", "quarter", 1.0), _note("C4", "quarter", 2.0), _note("D4", "quarter", 3.0)],
+        [_note("E4", "quarter", 0.0), _note("E4", "quarter", 1.0), _note("E4", "half", 2.0)],
+    ]
+    voice_2 = [
+        [_note("C3", "half", 0.0), _note("G2", "half", 2.0)],
+        [_note("C3", "half", 0.0), _note("G2", "eighth", 2.0), _note("C4", "eighth", 2.5)],
+    ]
+    melody = "1:64:1 1:62:1 1:60:1 1:62:1 2:64:1 2:64:1 2:64:2"
+    assert encode_melody([{"number": i + 1, "notes": notes} for i, notes in enumerate(voice_1)]) == melody
+
+    # Read in document order (all of voice 1, then voice 2), as on a piano or guitar staff
+    staff = [{"number": i + 1, "notes": voice_1[i] + voice_2[i]} for i in range(2)]
+    assert encode_melody(staff) == melody
+
+    # Or interleaved by time, as music21's flatten() returns them
+    for measure in staff:
+        measure["notes"].sort(key=lambda note: note["offset"])
+    assert encode_melody(staff) == melody
+
+if __name__ == "__main__":
+    test_melody_remove_and_reindex()
+    test_encode_two_voice_staff()
+    print("Melody index remove/reindex checks passed")
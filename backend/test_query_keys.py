@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+sys.path.append(os.path.join(os.path.dirname(__file__)))
+
+import agent
+from measure_store import MeasureStore
+
+def _chunk(chunk_id, file_name, title, instrument, measure):
+    return SimpleNamespace(id_=chunk_id, text=f"{instrument} {measure}", metadata={
+        "source_path": f"/scores/{file_name}", "file_name": file_name, "title": title,
+        "instrument": instrument, "measure_start": measure, "measure_end": measure,
+    })
+
+def test_extract_query_keys():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = MeasureStore(os.path.join(tmp, "measures.sqlite3"))
+        store.upsert([
+            _chunk("a", "der-leiermann.mxl", "Der Leiermann", "Voice", 5),
+            _chunk("b", "der-leiermann.mxl", "Der Leiermann", "Piano", 5),
+            _chunk("c", "001.xml", "나는 굳게 믿나이다", "알토", 3),
+            _chunk("d", "001.xml", "나는 굳게 믿나이다", "소프라노", 3),
+        ])
+        get_measure_store = agent.get_measure_store
+        agent.get_measure_store = lambda: store
+        try:
+            keys = agent.extract_query_keys("What does the voice sing in measure 5 of der-leiermann?")
+            assert keys == {"measure_number": 5, "file_name": "der-leiermann.mxl", "instrument": "Voice"}
+
+            # Korean particles directly after titles and part names
+            keys = agent.extract_query_keys("나는 굳게 믿나이다의 3마디에서 알토는 무슨 음이야?")
+            assert keys == {"measure_number": 3, "title": "나는 굳게 믿나이다", "instrument": "알토"}
+            keys = agent.extract_query_keys("Der Leiermann에서 피아노 5번째 마디")
+            assert keys == {"measure_number": 5, "title": "Der Leiermann"}
+            keys = agent.extract_query_keys("소프라노가 부르는 마디 3 알려줘")
+            assert keys == {"measure_number": 3, "instrument": "소프라노"}
+
+            # Names inside other words are not matches
+            assert agent.extract_query_keys("Voiceless pianos") == {}
+            assert agent.extract_query_keys("메조알토") == {}
+        finally:
+            agent.get_measure_store = get_measure_store
+
+if __name__ == "__main__":
+    test_extract_query_keys()
+    print("Query key extraction checks passed")
@@ -0,0 +1,142 @@
+"""
+Bounded worker pool for blocking request handlers.
+
+The agent path (embedding inference, Chroma queries, LLM calls) is
+synchronous. Run on the event loop it stalls every other request, so async
+endpoints hand it to a sized thread pool instead. A semaphore caps how many
+calls run at once; callers beyond that wait their turn, and beyond
+max_waiting they are turned away so the queue cannot grow without bound.
+Time spent waiting and running is recorded per call.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Tuple
+
+CHAT_WORKERS = int(os.environ.get("CLEF_CHAT_WORKERS", "4"))
+CHAT_MAX_CONCURRENCY = int(os.environ.get("CLEF_CHAT_MAX_CONCURRENCY", str(CHAT_WORKERS)))
+CHAT_MAX_WAITING = int(os.environ.get("CLEF_CHAT_MAX_WAITING", "64"))
+
+class PoolBusyError(Exception):
+    """Raised when too many calls are already waiting for a worker."""
+
+class BoundedWorkerPool:
+    """Thread pool behind a concurrency semaphore, with queueing metrics."""
+
+    def __init__(self, name: str, workers: int, max_concurrency: int, max_waiting: int):
+        self.name = name
+        self.workers = workers
+        self.max_concurrency = min(max_concurrency, workers)
+        self.max_waiting = max_waiting
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_queue_ms = 0.0
+        self.max_queue_ms = 0.0
+        self.total_run_ms = 0.0
+
+    def check_capacity(self):
+        """Raise PoolBusyError if a new call would exceed max_waiting."""
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise PoolBusyError(f"{self.waiting} requests already waiting for a {self.name} worker")
+
+    async def _acquire(self) -> float:
+        """Wait for a slot; returns the time spent queueing in ms."""
+        with self._lock:
+            self.waiting += 1
+        queued = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        queue_ms = (time.perf_counter() - queued) * 1000
+        with self._lock:
+            self.running += 1
+            self.total_queue_ms += queue_ms
+            self.max_queue_ms = max(self.max_queue_ms, queue_ms)
+        return queue_ms
+
+    def _release(self, run_ms: float, ok: bool):
+        self._semaphore.release()
+        with self._lock:
+            self.running -= 1
+            self.total_run_ms += run_ms
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Tuple[Any, Dict[str, float]]:
+        """Run fn(*args) on a worker; returns its result and the call's queue/run timings."""
+        self.check_capacity()
+        queue_ms = await self._acquire()
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            ok = True
+        finally:
+            run_ms = (time.perf_counter() - started) * 1000
+            self._release(run_ms, ok)
+        return result, {"queue_ms": round(queue_ms, 1), "run_ms": round(run_ms, 1)}
+
+    async def stream(self, fn: Callable[..., Iterator[Any]], *args: Any) -> AsyncIterator[Any]:
+        """Iterate the generator fn(*args) on a worker, holding one slot until it is exhausted.
+
+        The first item is a dict of queue timings ({"queue_ms": ...}); call
+        check_capacity() first to reject before a response is started.
+        """
+        queue_ms = await self._acquire()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        done = object()
+        ok = False
+        try:
+            yield {"queue_ms": round(queue_ms, 1)}
+            items = iter(fn(*args))
+            while True:
+                item = await loop.run_in_executor(self._executor, next, items, done)
+                if item is done:
+                    break
+                yield item
+            ok = True
+        finally:
+            self._release((time.perf_counter() - started) * 1000, ok)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "max_concurrency": self.max_concurrency,
+                "waiting": self.waiting,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_queue_ms": round(self.total_queue_ms / finished, 1) if finished else 0.0,
+                "max_queue_ms": round(self.max_queue_ms, 1),
+                "avg_run_ms": round(self.total_run_ms / finished, 1) if finished else 0.0,
+            }
+
+_chat_pool = None
+_chat_pool_lock = threading.Lock()
+
+def get_chat_pool() -> BoundedWorkerPool:
+    """Process-wide pool for agent calls, created on first use."""
+    global _chat_pool
+    with _chat_pool_lock:
+        if _chat_pool is None:
+            _chat_pool = BoundedWorkerPool("chat", CHAT_WORKERS, CHAT_MAX_CONCURRENCY, CHAT_MAX_WAITING)
+        return _chat_pool
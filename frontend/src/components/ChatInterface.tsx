@@ -3,9 +3,34 @@
 import { useState } from "react";
 import { Send } from "lucide-react";
 
+type Source = {
+    id: string;
+    title: string | null;
+    file_name: string | null;
+    instrument: string | null;
+    measure_start: number | null;
+    measure_end: number | null;
+};
+
+type Message = { role: 'user' | 'ai', content: string, sources?: Source[] };
+
+// Events sent by /chat/stream, one JSON object per "data:" line
+type StreamEvent =
+    | { type: 'sources', sources: Source[] }
+    | { type: 'token', text: string }
+    | { type: 'error', detail: string }
+    | { type: 'done' };
+
+function formatSource(source: Source) {
+    const measures = source.measure_start === source.measure_end
+        ? `m. ${source.measure_start}`
+        : `mm. ${source.measure_start}-${source.measure_end}`;
+    return `${source.title || source.file_name} · ${source.instrument} · ${measures}`;
+}
+
 export default function ChatInterface() {
     const [input, setInput] = useState("");
-    const [messages, setMessages] = useState<{ role: 'user' | 'ai', content: string }[]>([
+    const [messages, setMessages] = useState<Message[]>([
         { role: 'ai', content: "Tell me about the hymn \"Adam Te Deum\" by Palestrina. What are its key characteristics?" }
     ]);
     const [isLoading, setIsLoading] = useState(false);
@@ -18,8 +43,12 @@ export default function ChatInterface() {
         setMessages(prev => [...prev, { role: 'user', content: userMessage }]);
         setIsLoading(true);
 
+        // Updates the AI message being streamed (always the last one)
+        const updateReply = (update: (reply: Message) => Message) =>
+            setMessages(prev => [...prev.slice(0, -1), update(prev[prev.length - 1])]);
+
         try {
-            const response = await fetch('http://localhost:8000/chat', {
+            const response = await fetch('http://localhost:8000/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -27,12 +56,34 @@ export default function ChatInterface() {
                 body: JSON.stringify({ message: userMessage }),
             });
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error('Network response was not ok');
             }
 
-            const data = await response.json();
-            setMessages(prev => [...prev, { role: 'ai', content: data.response }]);
+            setMessages(prev => [...prev, { role: 'ai', content: "" }]);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                // Server-sent events are separated by a blank line
+                const events = buffer.split("\n\n");
+                buffer = events.pop() ?? "";
+                for (const raw of events) {
+                    if (!raw.startsWith("data: ")) continue;
+                    const event: StreamEvent = JSON.parse(raw.slice("data: ".length));
+                    if (event.type === 'sources') {
+                        updateReply(reply => ({ ...reply, sources: event.sources }));
+                    } else if (event.type === 'token') {
+                        setIsLoading(false);
+                        updateReply(reply => ({ ...reply, content: reply.content + event.text }));
+                    } else if (event.type === 'error') {
+                        throw new Error(event.detail);
+                    }
+                }
+            }
         } catch (error) {
             console.error("Error sending message:", error);
             setMessages(prev => [...prev, { role: 'ai', content: "Sorry, I encountered an error processing your request." }]);
@@ -50,7 +101,7 @@ export default function ChatInterface() {
 
             {/* Messages */}
             <div className="flex-1 overflow-y-auto p-4 space-y-4">
-                {messages.map((msg, idx) => (
+                {messages.filter(msg => msg.content || msg.sources).map((msg, idx) => (
                     <div
                         key={idx}
                         className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}
@@ -61,7 +112,14 @@ export default function ChatInterface() {
                                     : 'bg-[var(--surface-highlight)] text-[var(--text-primary)]'
                                 }`}
                         >
-                            {msg.content}
+                            <div className="whitespace-pre-wrap">{msg.content}</div>
+                            {msg.sources && msg.sources.length > 0 && (
+                                <ul className="mt-2 pt-2 border-t border-[var(--border)] text-xs text-[var(--text-secondary)] space-y-1">
+                                    {msg.sources.map(source => (
+                                        <li key={source.id}>{formatSource(source)}</li>
+                                    ))}
+                                </ul>
+                            )}
                         </div>
                     </div>
                 ))}
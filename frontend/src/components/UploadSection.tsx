@@ -3,10 +3,42 @@
 import { useState, useRef } from "react";
 import { Upload, FileMusic, CheckCircle, AlertCircle } from "lucide-react";
 
+// Status of a background conversion/indexing job, from /jobs/{id}
+type Job = {
+    stage: "queued" | "converting" | "indexing" | "done" | "failed";
+    progress: { indexed: number; total: number | null };
+    result: { abc_preview: string; chunks: number; embedded: number } | null;
+    error: string | null;
+};
+
+const JOB_POLL_INTERVAL_MS = 1000;
+
+async function waitForJob(jobId: string, onUpdate: (job: Job) => void): Promise<Job> {
+    while (true) {
+        const response = await fetch(`http://localhost:8000/jobs/${jobId}`);
+        if (!response.ok) {
+            throw new Error("Could not get job status");
+        }
+        const job: Job = await response.json();
+        onUpdate(job);
+        if (job.stage === "done" || job.stage === "failed") {
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+}
+
+function describeJob(fileName: string, job: Job) {
+    if (job.stage === "indexing" && job.progress.total) {
+        return `Indexing ${fileName}: ${job.progress.indexed}/${job.progress.total} measures`;
+    }
+    return job.stage === "converting" ? `Converting ${fileName}...` : `Processing ${fileName}...`;
+}
+
 export default function UploadSection() {
     const [uploading, setUploading] = useState(false);
     const [uploadStatus, setUploadStatus] = useState<{
-        type: "success" | "error" | null;
+        type: "success" | "error" | "progress" | null;
         message: string;
     }>({ type: null, message: "" });
     const fileInputRef = useRef<HTMLInputElement>(null);
@@ -64,10 +96,24 @@ export default function UploadSection() {
             }
 
             const data = await response.json();
-            setUploadStatus({
-                type: "success",
-                message: `Successfully uploaded ${file.name}!`,
-            });
+            if (data.job_id) {
+                // MusicXML is converted and indexed in the background
+                const job = await waitForJob(data.job_id, job =>
+                    setUploadStatus({ type: "progress", message: describeJob(file.name, job) })
+                );
+                if (job.stage === "failed") {
+                    throw new Error(job.error ?? "Processing failed");
+                }
+                setUploadStatus({
+                    type: "success",
+                    message: `Successfully indexed ${file.name} (${job.result?.chunks} chunks)!`,
+                });
+            } else {
+                setUploadStatus({
+                    type: "success",
+                    message: `Successfully uploaded ${file.name}!`,
+                });
+            }
 
             // Clear the file input
             if (fileInputRef.current) {
@@ -138,11 +184,15 @@ export default function UploadSection() {
                 <div
                     className={`absolute bottom-4 left-4 right-4 p-3 rounded-lg flex items-center gap-2 ${uploadStatus.type === "success"
                             ? "bg-green-500/20 border border-green-500/50"
-                            : "bg-red-500/20 border border-red-500/50"
+                            : uploadStatus.type === "progress"
+                                ? "bg-[rgba(255,255,255,0.05)] border border-[var(--border)]"
+                                : "bg-red-500/20 border border-red-500/50"
                         }`}
                 >
                     {uploadStatus.type === "success" ? (
                         <CheckCircle size={18} className="text-green-400" />
+                    ) : uploadStatus.type === "progress" ? (
+                        <FileMusic size={18} className="text-[var(--primary)]" />
                     ) : (
                         <AlertCircle size={18} className="text-red-400" />
                     )}